@@ -1,8 +1,13 @@
 import os
-import json
-from typing import Dict, Any
+import re
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
-import httpx
+from scheduler import upstream_slot, QuotaExceededError
+from http_clients import get_client
+from deadline import timeout_for
+from rollups import record_analysis
+from api.ms.analysis import repair_json, validate_analysis
+from api.ms.models import ANALYSIS_JSON_SCHEMA, analysis_schema_for
 
 load_dotenv()
 
@@ -16,6 +21,79 @@ HEADERS = {
     "api-key": AZURE_OPENAI_KEY
 }
 
+# "json_schema" (structured outputs), "json_object" (JSON mode) or "none"
+ANALYZER_RESPONSE_FORMAT = os.getenv("ANALYZER_RESPONSE_FORMAT", "json_schema")
+_response_format_mode = ANALYZER_RESPONSE_FORMAT
+
+# Parse-failure and repair counters, exposed on /analyzer/stats
+PARSE_STATS = {
+    "analyses": 0,
+    "parsedDirectly": 0,
+    "repairedLocally": 0,
+    "unparseable": 0,
+    "truncated": 0,
+    "incomplete": 0,
+    "reasked": 0,
+    "reaskRecovered": 0,
+    "fieldsDefaulted": 0,
+    "failed": 0,
+}
+
+def parse_stats() -> dict:
+    analyses = PARSE_STATS["analyses"]
+    rate = lambda name: round(PARSE_STATS[name] / analyses, 4) if analyses else 0.0
+    return {
+        **PARSE_STATS,
+        "responseFormat": _response_format_mode,
+        "repairRate": rate("repairedLocally"),
+        "reaskRate": rate("reasked"),
+        "failureRate": rate("failed"),
+    }
+
+def _response_format(fields: Optional[List[str]] = None) -> Optional[dict]:
+    if _response_format_mode == "json_schema":
+        schema = analysis_schema_for(fields) if fields else ANALYSIS_JSON_SCHEMA
+        return {"type": "json_schema", "json_schema": {"name": "article_analysis", "strict": True, "schema": schema}}
+    if _response_format_mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+def _rejects_response_format(error_body: str) -> bool:
+    body = (error_body or "").lower()
+    return "response_format" in body or "json_schema" in body
+
+async def _chat(messages: List[dict], max_tokens: int, fields: Optional[List[str]] = None) -> Tuple[str, Optional[str]]:
+    """Call the deployment with structured output and return (content, finish_reason)."""
+    global _response_format_mode
+    payload = {
+        "messages": messages,
+        "temperature": 0.2,
+        "max_tokens": max_tokens
+    }
+    response_format = _response_format(fields)
+    if response_format:
+        payload["response_format"] = response_format
+
+    url = f"{AZURE_OPENAI_ENDPOINT}/openai/deployments/{AZURE_OPENAI_DEPLOYMENT}/chat/completions?api-version={AZURE_OPENAI_API_VERSION}"
+    client = get_client("azure_openai")
+    async with upstream_slot("llm"):
+        response = await client.post(url, headers=HEADERS, json=payload, timeout=timeout_for(30))
+
+    if (
+        response.status_code == 400
+        and _response_format_mode == "json_schema"
+        and _rejects_response_format(response.text)
+    ):
+        # Deployment without structured-output support: fall back to plain JSON mode.
+        # Other 400s (e.g. content-filter rejections) are per-article and must not switch modes.
+        print(f"Structured output rejected, falling back to JSON mode: {response.text[:200]}")
+        _response_format_mode = "json_object"
+        return await _chat(messages, max_tokens, fields)
+
+    response.raise_for_status()
+    choice = response.json()["choices"][0]
+    return choice["message"].get("content") or "", choice.get("finish_reason")
+
 async def analyze_article(entity_name: str, entity_description: str, article: dict) -> dict:
     """
     Analyze a single article using Azure OpenAI and return structured results.
@@ -49,6 +127,7 @@ Return a JSON object with the following fields:
 
 Respond ONLY with a valid JSON object. Do not include any explanation or commentary.
 """
+    field_descriptions = dict(re.findall(r"^- (\w+) (.+)$", system_prompt, re.MULTILINE))
 
     user_prompt = f"""
 Entity Name: {entity_name}
@@ -58,63 +137,106 @@ Article Content: {content}
 Article Publish Date: {article.get("publishDate", "Unknown")}
 """
 
-    payload = {
-        "messages": [
-            {"role": "system", "content": system_prompt.strip()},
-            {"role": "user", "content": user_prompt.strip()}
-        ],
-        "temperature": 0.2,
-        "max_tokens": 1000
-    }
+    try:
+        PARSE_STATS["analyses"] += 1
+        raw, finish_reason = await _chat(
+            [
+                {"role": "system", "content": system_prompt.strip()},
+                {"role": "user", "content": user_prompt.strip()}
+            ],
+            max_tokens=1000,
+        )
+        if finish_reason == "length":
+            PARSE_STATS["truncated"] += 1
 
-    url = f"{AZURE_OPENAI_ENDPOINT}/openai/deployments/{AZURE_OPENAI_DEPLOYMENT}/chat/completions?api-version={AZURE_OPENAI_API_VERSION}"
+        # Cheap local repair first (fences, trailing commas, truncation), then validate
+        data, repaired = repair_json(raw)
+        if not data:
+            # An empty object recovers nothing either, so it is not counted as a repair
+            PARSE_STATS["unparseable"] += 1
+            data = {}
+        else:
+            PARSE_STATS["repairedLocally" if repaired else "parsedDirectly"] += 1
+        data, missing = validate_analysis(data)
 
-    try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.post(url, headers=HEADERS, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            content = result["choices"][0]["message"]["content"]
-            data = json.loads(content)
-
-            # Preserve the original publishDate from news extraction, don't let AI override it
-            original_publish_date = article.get("publishDate", None)
-            ai_publish_date = data.get("publishDate", None)
-            
-            # Always prefer original date from news extraction over AI response
-            # Only use AI date if original is completely missing
-            if original_publish_date and original_publish_date.strip():
-                final_publish_date = original_publish_date
-                print(f"Using original date: {original_publish_date}")
-            elif ai_publish_date and ai_publish_date.strip():
-                final_publish_date = ai_publish_date
-                print(f"Using AI date: {ai_publish_date}")
-            else:
-                # Last resort fallback if both are null/empty
-                from datetime import datetime, timedelta
-                yesterday = datetime.now() - timedelta(days=1)
-                final_publish_date = yesterday.isoformat() + "Z"
-                print(f"Using analyzer fallback date: {final_publish_date}")
-            
-            result = {
-                "subjectMatchScore": data.get("subjectMatchScore", 0),
-                "matchedDetails": data.get("matchedDetails", []),
-                "tags": data.get("tags", []),
-                "sentiment": data.get("sentiment", "neutral"),
-                "crimeRelated": data.get("crimeRelated", False),
-                "unethicalRelated": data.get("unethicalRelated", False),
-                "confidence": data.get("confidence", 0),
-                "summary": data.get("summary", "No summary available."),
-                "catchyTitle": data.get("catchyTitle", ""),
-                "publishDate": final_publish_date,
-                "isPaywalled": data.get("isPaywalled", False),
-                "originalTitle": article.get("title", ""),
-                "url": article.get("url", ""),
-                "source": article.get("source", "")
-            }
-            
-            return result
+        if missing:
+            # Re-ask only for the fields we could not recover instead of failing the article
+            PARSE_STATS["incomplete"] += 1
+            PARSE_STATS["reasked"] += 1
+            print(f"Re-asking for missing fields {missing}: {article.get('title', 'No title')[:50]}")
+            reask_prompt = "You are an expert media analyst. Return a JSON object with ONLY these fields:\n" + "\n".join(
+                f"- {name} {field_descriptions.get(name, '')}" for name in missing
+            )
+            try:
+                raw, _ = await _chat(
+                    [
+                        {"role": "system", "content": reask_prompt},
+                        {"role": "user", "content": user_prompt.strip()}
+                    ],
+                    max_tokens=600,
+                    fields=missing,
+                )
+                extra, _ = repair_json(raw)
+                if extra:
+                    extra, _ = validate_analysis({name: value for name, value in extra.items() if name in missing})
+                    data.update(extra)
+            except QuotaExceededError:
+                raise
+            except Exception as e:
+                print(f"Re-ask failed: {e}")
+            missing = [name for name in missing if name not in data]
+            if not missing:
+                PARSE_STATS["reaskRecovered"] += 1
+
+        if not data:
+            PARSE_STATS["failed"] += 1
+            raise ValueError("Could not parse analysis from model output")
+        PARSE_STATS["fieldsDefaulted"] += len(missing)
+
+        # Preserve the original publishDate from news extraction, don't let AI override it
+        original_publish_date = article.get("publishDate", None)
+        ai_publish_date = data.get("publishDate", None)
+        
+        # Always prefer original date from news extraction over AI response
+        # Only use AI date if original is completely missing
+        if original_publish_date and original_publish_date.strip():
+            final_publish_date = original_publish_date
+            print(f"Using original date: {original_publish_date}")
+        elif ai_publish_date and ai_publish_date.strip():
+            final_publish_date = ai_publish_date
+            print(f"Using AI date: {ai_publish_date}")
+        else:
+            # Last resort fallback if both are null/empty
+            from datetime import datetime, timedelta
+            yesterday = datetime.now() - timedelta(days=1)
+            final_publish_date = yesterday.isoformat() + "Z"
+            print(f"Using analyzer fallback date: {final_publish_date}")
+        
+        result = {
+            "subjectMatchScore": data.get("subjectMatchScore", 0),
+            "matchedDetails": data.get("matchedDetails", []),
+            "tags": data.get("tags", []),
+            "sentiment": data.get("sentiment", "neutral"),
+            "crimeRelated": data.get("crimeRelated", False),
+            "unethicalRelated": data.get("unethicalRelated", False),
+            "confidence": data.get("confidence", 0),
+            "summary": data.get("summary", "No summary available."),
+            "catchyTitle": data.get("catchyTitle", ""),
+            "publishDate": final_publish_date,
+            "isPaywalled": data.get("isPaywalled", False),
+            "originalTitle": article.get("title", ""),
+            "url": article.get("url", ""),
+            "source": article.get("source", "")
+        }
+
+        # Keep the dashboard's sentiment/coverage rollups current
+        await record_analysis(entity_name, result)
+        
+        return result
 
+    except QuotaExceededError:
+        # Surfaced by the caller as a partial result or a 429, not as an error row
+        raise
     except Exception as e:
         return {
             "error": str(e),
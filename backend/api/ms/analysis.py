@@ -0,0 +1,141 @@
+import re
+import json
+from typing import Optional, Tuple, List
+from pydantic import ValidationError
+from api.ms.models import ArticleAnalysis, REQUIRED_ANALYSIS_FIELDS
+
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_PY_LITERAL_RE = re.compile(r"True|False|None")
+# A value that may have been cut off mid-token: a bare word, or a number (85 -> 8)
+_PARTIAL_VALUE_RE = re.compile(r'(,?\s*"[^"]*"\s*:\s*)?(\b[A-Za-z]+|-?\d[\d.eE+-]*)$')
+
+
+def _close_truncated(text: str) -> str:
+    """Close the strings, arrays and objects left open when model output was cut off."""
+    stack = []
+    in_string = False
+    string_start = 0
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+            string_start = i
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+
+    if in_string:
+        # A cut-off string is incomplete, so drop it rather than keep half a value
+        text = text[:string_start]
+    text = text.rstrip()
+    # Drop a value cut off mid-token, e.g. `"crimeRelated": tru` or `"confidence": 8` (from 85).
+    # A trailing number can't be told apart from a complete one, so it goes too.
+    partial = _PARTIAL_VALUE_RE.search(text)
+    if partial and partial.group(2) not in ("true", "false", "null", "True", "False", "None"):
+        text = text[:partial.start()].rstrip()
+    # Drop a dangling separator or a key that never got its value
+    text = re.sub(r',\s*$', "", text)
+    text = re.sub(r',?\s*"[^"]*"\s*:\s*$', "", text)
+    return text + "".join(reversed(stack))
+
+
+def _replace_py_literals(text: str) -> str:
+    """Turn Python True/False/None into JSON literals where they stand as values, never inside strings."""
+    out = []
+    i = 0
+    in_string = False
+    escaped = False
+    last_token = ""
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            out.append(ch)
+            i += 1
+            continue
+        if ch == '"':
+            in_string = True
+        elif last_token in (":", "[", ","):
+            literal = _PY_LITERAL_RE.match(text, i)
+            if literal and not text[literal.end():literal.end() + 1].isalnum():
+                out.append(_PY_LITERALS[literal.group()])
+                i = literal.end()
+                last_token = "literal"
+                continue
+        if not ch.isspace():
+            last_token = ch
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def repair_json(raw: str) -> Tuple[Optional[dict], bool]:
+    """
+    Parse model output as a JSON object, applying cheap local fixes if needed:
+    markdown fences, surrounding prose, trailing commas, Python literals and truncation.
+    Returns (data, repaired) where data is None if nothing could be recovered.
+    """
+    if not raw:
+        return None, False
+    try:
+        data = json.loads(raw)
+        return (data, False) if isinstance(data, dict) else (None, False)
+    except json.JSONDecodeError:
+        pass
+
+    text = _FENCE_RE.sub("", raw.strip())
+    start = text.find("{")
+    if start == -1:
+        return None, False
+    # raw_decode stops at the end of the first object, so prose after it (even with braces) is ignored
+    decoder = json.JSONDecoder()
+    for candidate in (text[start:], _close_truncated(text[start:])):
+        for fixed in (
+            candidate,
+            _TRAILING_COMMA_RE.sub(r"\1", candidate),
+            _replace_py_literals(_TRAILING_COMMA_RE.sub(r"\1", candidate)),
+        ):
+            try:
+                data, _ = decoder.raw_decode(fixed)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, dict):
+                return data, True
+    return None, False
+
+
+def validate_analysis(data: dict) -> Tuple[dict, List[str]]:
+    """
+    Validate parsed output against ArticleAnalysis, dropping fields that fail.
+    Returns (valid fields, names of required fields still missing).
+    """
+    known = {name: value for name, value in data.items() if name in ArticleAnalysis.model_fields}
+    while True:
+        try:
+            analysis = ArticleAnalysis.model_validate(known)
+            break
+        except ValidationError as e:
+            bad_fields = {error["loc"][0] for error in e.errors() if error.get("loc")}
+            if not bad_fields & known.keys():
+                raise
+            for name in bad_fields:
+                known.pop(name, None)
+
+    valid = {name: value for name, value in analysis.model_dump().items() if value is not None}
+    missing = [name for name in REQUIRED_ANALYSIS_FIELDS if name not in valid]
+    return valid, missing
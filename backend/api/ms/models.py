@@ -0,0 +1,71 @@
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field, field_validator
+
+
+class ArticleAnalysis(BaseModel):
+    """
+    Typed form of the analyzer's JSON output.
+    Every field is optional so one bad field can be dropped and re-asked without losing the rest.
+    """
+
+    subjectMatchScore: Optional[float] = Field(default=None, ge=0, le=100)
+    matchedDetails: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+    sentiment: Optional[Literal["positive", "neutral", "negative"]] = None
+    crimeRelated: Optional[bool] = None
+    unethicalRelated: Optional[bool] = None
+    confidence: Optional[float] = Field(default=None, ge=0, le=100)
+    summary: Optional[str] = None
+    catchyTitle: Optional[str] = None
+    publishDate: Optional[str] = None
+    isPaywalled: Optional[bool] = None
+
+    @field_validator("sentiment", mode="before")
+    @classmethod
+    def normalize_sentiment(cls, value):
+        return value.strip().lower() if isinstance(value, str) else value
+
+    @field_validator("subjectMatchScore", "confidence", mode="before")
+    @classmethod
+    def strip_percent(cls, value):
+        return value.strip().rstrip("%") if isinstance(value, str) else value
+
+    @field_validator("matchedDetails", "tags", mode="before")
+    @classmethod
+    def wrap_single_string(cls, value):
+        return [value] if isinstance(value, str) else value
+
+
+# Fields the analysis needs; publishDate may legitimately be null
+REQUIRED_ANALYSIS_FIELDS = [name for name in ArticleAnalysis.model_fields if name != "publishDate"]
+
+# JSON schema sent as the model's structured-output format (strict mode: every field
+# listed as required, no extra properties; ranges are checked by ArticleAnalysis instead)
+ANALYSIS_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "subjectMatchScore": {"type": "number"},
+        "matchedDetails": {"type": "array", "items": {"type": "string"}},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "sentiment": {"type": "string", "enum": ["positive", "neutral", "negative"]},
+        "crimeRelated": {"type": "boolean"},
+        "unethicalRelated": {"type": "boolean"},
+        "confidence": {"type": "number"},
+        "summary": {"type": "string"},
+        "catchyTitle": {"type": "string"},
+        "publishDate": {"type": ["string", "null"]},
+        "isPaywalled": {"type": "boolean"},
+    },
+    "required": list(ArticleAnalysis.model_fields),
+    "additionalProperties": False,
+}
+
+
+def analysis_schema_for(fields: List[str]) -> dict:
+    """The structured-output schema restricted to some fields, for re-asking only those."""
+    return {
+        "type": "object",
+        "properties": {name: ANALYSIS_JSON_SCHEMA["properties"][name] for name in fields},
+        "required": list(fields),
+        "additionalProperties": False,
+    }
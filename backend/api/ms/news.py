@@ -1,15 +1,18 @@
 import os
+import json
+import asyncio
 import httpx
-from typing import List, Dict
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional
 from dotenv import load_dotenv
-from trafilatura import fetch_url, extract
-from trafilatura.settings import use_config
-from trafilatura.meta import reset_caches
-import requests
-from bs4 import BeautifulSoup
-from dateutil.parser import parse
 from datetime import datetime, timedelta
 import re
+from scheduler import upstream_slot, QuotaExceededError, QUEUES, current_priority, PRIORITY_WEIGHTS
+from http_clients import get_client
+from deadline import expired, timeout_for, mark_partial
+from api.ms.query_planner import planner
+from shared_store import get_or_compute
 
 load_dotenv()
 
@@ -32,6 +35,7 @@ def parse_relative_date(date_str: str) -> str:
         if not number_match:
             # Try to parse as regular date if no numbers found
             try:
+                from dateutil.parser import parse
                 parsed_date = parse(original_date_str)
                 return parsed_date.isoformat() + "Z"
             except:
@@ -67,6 +71,7 @@ def parse_relative_date(date_str: str) -> str:
         # If no time unit matched, try to parse as regular date
         else:
             try:
+                from dateutil.parser import parse
                 parsed_date = parse(original_date_str)
                 return parsed_date.isoformat() + "Z"
             except:
@@ -232,6 +237,11 @@ OPENAI_HEADERS = {
 
 
 def extract_full_content(url: str) -> str:
+    # trafilatura (and lxml under it) is only loaded once a page actually needs scraping
+    from trafilatura import fetch_url, extract
+    from trafilatura.settings import use_config
+    from trafilatura.meta import reset_caches
+
     config = use_config()
     config.set("DEFAULT", "EXTRACTION_TIMEOUT", "20")
     config.set("DEFAULT", "FETCH_TIMEOUT", "10")
@@ -258,10 +268,62 @@ def extract_full_content(url: str) -> str:
         print(f"Trafilatura error for {url}: {e}")
     return ""
 
+class SharedFetchCache:
+    """
+    Coalesces identical translation, Serper and scraping work across the searches of one bulk run.
+    It only lives for that run, so nothing cached here can go stale.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        for future in self.entries.values():
+            future.cancel()
+
+    async def get_or_run(self, kind: str, key, factory):
+        full_key = (kind, key)
+        future = self.entries.get(full_key)
+        if future is None:
+            self.misses[kind] += 1
+            future = asyncio.ensure_future(factory())
+            self.entries[full_key] = future
+        else:
+            self.hits[kind] += 1
+        try:
+            # Shielded so one entity hitting its deadline doesn't cancel work others wait on
+            return await asyncio.shield(future)
+        except Exception:
+            # Let a later caller retry instead of sharing a transient failure
+            if self.entries.get(full_key) is future:
+                del self.entries[full_key]
+            raise
+
+    def stats(self) -> dict:
+        return {kind: {"calls": self.misses[kind], "shared": self.hits[kind]} for kind in set(self.misses) | set(self.hits)}
+
+async def run_shared(cache: Optional[SharedFetchCache], kind: str, key, factory):
+    """
+    Run factory once per (kind, key): within a bulk run via cache, and across requests and
+    workers via the shared store's result cache and in-flight markers. A None key is never shared.
+    """
+    if key is None:
+        return await factory()
+    weight = PRIORITY_WEIGHTS.get(current_priority.get(), 1.0)
+    shared_factory = lambda: get_or_compute(kind, key, factory, weight)
+    if cache is None:
+        return await shared_factory()
+    return await cache.get_or_run(kind, key, shared_factory)
+
 async def translate_keywords(keywords: List[str], target_language: str) -> List[str]:
     if not keywords:
         return []
-    prompt = f"Translate the following keywords into {target_language}. Return only a comma-separated list.\n\n" + ", ".join(keywords)
+    prompt = f"Translate the following keywords into {target_language}. Return only a comma-separated list, in the same order.\n\n" + ", ".join(keywords)
     payload = {
         "messages": [
             {"role": "system", "content": "You are a translator."},
@@ -272,121 +334,212 @@ async def translate_keywords(keywords: List[str], target_language: str) -> List[
     }
     url = f"{AZURE_OPENAI_ENDPOINT}/openai/deployments/{AZURE_OPENAI_DEPLOYMENT}/chat/completions?api-version={AZURE_OPENAI_API_VERSION}"
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            response = await client.post(url, headers=OPENAI_HEADERS, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            content = result["choices"][0]["message"]["content"]
-            return [kw.strip() for kw in content.split(",") if kw.strip()]
+        client = get_client("azure_openai")
+        async with upstream_slot("llm"):
+            response = await client.post(url, headers=OPENAI_HEADERS, json=payload, timeout=timeout_for(15))
+        response.raise_for_status()
+        result = response.json()
+        content = result["choices"][0]["message"]["content"]
+        return [kw.strip() for kw in content.split(",") if kw.strip()]
+    except QuotaExceededError:
+        raise
     except Exception as e:
         print(f"Translation error: {e}")
         return []
 
-def generate_query_variants(entity: str, tags: List[str], translated_tags: List[str]) -> List[str]:
-    queries = [entity]  # Simple entity search
+def generate_typed_query_variants(entity: str, tags: List[str], translated_tags: List[str]) -> List[Tuple[str, str]]:
+    """Query variants paired with their type, which the query planner tracks yield by."""
+    queries = [(entity, "entity")]  # Simple entity search
     
     # Add simple tag-based queries without complex operators
     if tags:
         for tag in tags[:3]:  # Limit to first 3 tags
-            queries.append(f'{entity} {tag}')
+            queries.append((f'{entity} {tag}', "tag"))
     
     # Add simple translated tag queries
     if translated_tags:
         for tag in translated_tags[:2]:  # Limit to first 2 translated tags
-            queries.append(f'{entity} {tag}')
+            queries.append((f'{entity} {tag}', "translated_tag"))
     return queries
 
-async def get_all_news_data(query: Dict) -> List[Dict]:
+def generate_query_variants(entity: str, tags: List[str], translated_tags: List[str]) -> List[str]:
+    return [q for q, _ in generate_typed_query_variants(entity, tags, translated_tags)]
+
+async def fetch_serper_news(client: httpx.AsyncClient, payload: Dict) -> List[Dict]:
+    async with upstream_slot("serper"):
+        response = await client.post(SERPER_API_URL, headers=HEADERS, json=payload, timeout=timeout_for(100))
+    response.raise_for_status()
+    data = response.json()
+    return data.get("news", [])
+
+# trafilatura can't be interrupted, so a timed-out or cancelled scrape keeps its thread until it
+# finishes. A dedicated pool sized to the scrape capacity keeps real scraping within that limit
+# (scrapes still queued in the pool are dropped on cancel).
+_scrape_executor = ThreadPoolExecutor(max_workers=QUEUES["scrape"].capacity, thread_name_prefix="scrape")
+
+async def extract_full_content_async(url: str) -> str:
+    try:
+        async with upstream_slot("scrape"):
+            scrape = asyncio.get_running_loop().run_in_executor(_scrape_executor, extract_full_content, url)
+            return await asyncio.wait_for(scrape, timeout=timeout_for(20))
+    except asyncio.TimeoutError:
+        print(f"Content extraction timed out for {url}")
+        return ""
+
+def target_language_for(country: str) -> str:
+    return "Hindi" if country.lower() == "in" else "local language"
+
+async def translate_tag_union(entries: List[Tuple[str, List[str]]], cache: Optional[SharedFetchCache] = None) -> Dict[str, Dict[str, str]]:
+    """
+    Translate every distinct tag of a bulk run once per target language.
+    Takes (country, tags) pairs; returns {target language: {tag: translation}}. A language whose
+    translation doesn't line up one-to-one with its tags is left out, so its entries translate their own tags.
+    """
+    union: Dict[str, List[str]] = {}
+    for country, tags in entries:
+        tags_for_language = union.setdefault(target_language_for(country), [])
+        tags_for_language.extend(tag for tag in tags or [] if tag not in tags_for_language)
+
+    async def translate(language: str, tags: List[str]) -> Tuple[str, Dict[str, str]]:
+        translated = await run_shared(
+            cache, "translate", (tuple(tags), language), lambda: translate_keywords(tags, language)
+        )
+        if len(translated) != len(tags):
+            print(f"Tag translation into {language} returned {len(translated)} of {len(tags)} tags, not shared")
+            return language, {}
+        return language, dict(zip(tags, translated))
+
+    results = await asyncio.gather(*(translate(language, tags) for language, tags in union.items() if tags))
+    return {language: mapping for language, mapping in results if mapping}
+
+async def get_all_news_data(
+    query: Dict, cache: Optional[SharedFetchCache] = None, translations: Optional[Dict[str, Dict[str, str]]] = None
+) -> List[Dict]:
     entity = query.get("query")
     options = query.get("advanced_options", {})
     country = options.get("country", ["US"])[0].lower()
     tags = options.get("detailed_query", [])
     date_range = options.get("date_range")
 
-    translated_tags = await translate_keywords(tags, "Hindi" if country == "in" else "local language")
-    query_variants = generate_query_variants(entity, tags, translated_tags)
+    target_language = target_language_for(country)
+    known = (translations or {}).get(target_language, {})
+    if all(tag in known for tag in tags):
+        # Translated once for the whole bulk run
+        translated_tags = [known[tag] for tag in tags]
+    else:
+        translated_tags = await run_shared(
+            cache, "translate", (tuple(tags), target_language), lambda: translate_keywords(tags, target_language)
+        )
+    # Planning and recording read and write the shared store (SQLite), so they run off the event loop
+    query_plan = await asyncio.to_thread(
+        planner.plan, country, generate_typed_query_variants(entity, tags, translated_tags)
+    )
 
     articles = []
     seen_urls = set()
 
     try:
-        async with httpx.AsyncClient(timeout=100) as client:
-            for q in query_variants:
-                for lang in ["en", "hi", "auto"]:
-                    payload = {
-                        "q": q,
-                        "hl": lang,
-                        "gl": country,
-                        "num": 100  # Reduced to get more relevant results
-                    }
+        client = get_client("serper")
+        recent_new_urls = []
+        for i, (q, lang, variant_type, expected) in enumerate(query_plan):
+            if expired():
+                mark_partial("serper fan-out stopped before all query variants ran")
+                break
+            if planner.should_stop(recent_new_urls, expected):
+                print(f"Stopping Serper fan-out after {i} of {len(query_plan)} calls: new-URL yield too low")
+                break
+            payload = {
+                "q": q,
+                "hl": lang,
+                "gl": country,
+                "num": 100  # Reduced to get more relevant results
+            }
+            
+            if date_range:
+                from_date = date_range.get("from_date")
+                to_date = date_range.get("to_date")
+                if from_date and to_date:
+                    payload["publishedAfter"] = from_date
+                    payload["publishedBefore"] = to_date
+            
+            try:
+                news_items = await run_shared(
+                    cache, "serper", json.dumps(payload, sort_keys=True),
+                    lambda payload=payload: fetch_serper_news(client, payload)
+                )
+                urls_before = len(seen_urls)
+                
+                for item in news_items:
+                    url = item.get("link", "")
+                    if url in seen_urls:
+                        continue
+                    seen_urls.add(url)
                     
-                    if date_range:
-                        from_date = date_range.get("from_date")
-                        to_date = date_range.get("to_date")
-                        if from_date and to_date:
-                            payload["publishedAfter"] = from_date
-                            payload["publishedBefore"] = to_date
+                    # Parse the relative date from Serper API first
+                    raw_date = item.get("date", "")
+                    parsed_date = parse_relative_date(raw_date)
                     
-                    try:
-                        response = await client.post(SERPER_API_URL, headers=HEADERS, json=payload)
-                        response.raise_for_status()
-                        data = response.json()
-                        news_items = data.get("news", [])
+                    # If no date from Serper, try multiple fallback methods
+                    if not parsed_date or parsed_date.strip() == "":
+                        print(f"No date from Serper for {url}, trying fallbacks...")
                         
-                        for item in news_items:
-                            url = item.get("link", "")
-                            if url in seen_urls:
-                                continue
-                            seen_urls.add(url)
-                            
-                            # Parse the relative date from Serper API first
-                            raw_date = item.get("date", "")
-                            parsed_date = parse_relative_date(raw_date)
-                            
-                            # If no date from Serper, try multiple fallback methods
-                            if not parsed_date or parsed_date.strip() == "":
-                                print(f"No date from Serper for {url}, trying fallbacks...")
-                                
-                                # Try URL/title extraction first (faster)
-                                title = item.get("title", "")
-                                url_date = extract_date_from_url_or_title(url, title)
-                                if url_date:
-                                    parsed_date = url_date
-                                    print(f"Found date in URL/title: {url_date}")
-                                    content = item.get("snippet", "")  # Use snippet since we found date elsewhere
-                                else:
-                                    # Fall back to content extraction (slower)
-                                    print(f"Trying content extraction for {url}...")
-                                    full_content = extract_full_content(url)
-                                    if full_content:
-                                        content_date = extract_date_from_content(full_content, url)
-                                        if content_date:
-                                            parsed_date = content_date
-                                            print(f"Found date in content: {content_date}")
-                                        content = full_content
-                                    else:
-                                        print(f"No content extracted for {url}")
-                                        content = item.get("snippet", "")
-                                
-                                # Final fallback: use recent date for news articles if we still don't have a date
-                                # Most news without dates are recent, so use yesterday as reasonable estimate
-                                if not parsed_date or parsed_date.strip() == "":
-                                    yesterday = datetime.now() - timedelta(days=1)
-                                    parsed_date = yesterday.isoformat() + "Z"
-                                    print(f"Using fallback date (yesterday): {parsed_date}")
+                        # Try URL/title extraction first (faster)
+                        title = item.get("title", "")
+                        url_date = extract_date_from_url_or_title(url, title)
+                        if url_date:
+                            parsed_date = url_date
+                            print(f"Found date in URL/title: {url_date}")
+                            content = item.get("snippet", "")  # Use snippet since we found date elsewhere
+                        elif expired():
+                            mark_partial("content extraction skipped for some articles")
+                            content = item.get("snippet", "")
+                        else:
+                            # Fall back to content extraction (slower)
+                            print(f"Trying content extraction for {url}...")
+                            full_content = await run_shared(
+                                cache, "scrape", url, lambda url=url: extract_full_content_async(url)
+                            )
+                            if full_content:
+                                content_date = extract_date_from_content(full_content, url)
+                                if content_date:
+                                    parsed_date = content_date
+                                    print(f"Found date in content: {content_date}")
+                                content = full_content
                             else:
-                                # Use snippet if we have date from Serper
+                                print(f"No content extracted for {url}")
                                 content = item.get("snippet", "")
-                            
-                            articles.append({
-                                "title": item.get("title", ""),
-                                "content": content,
-                                "url": url,
-                                "source": item.get("source", "Unknown"),
-                                "publishDate": parsed_date
-                            })
-                    except Exception as e:
-                        print(f"Error fetching query '{q}' with lang '{lang}': {e}")
+                        
+                        # Final fallback: use recent date for news articles if we still don't have a date
+                        # Most news without dates are recent, so use yesterday as reasonable estimate
+                        if not parsed_date or parsed_date.strip() == "":
+                            yesterday = datetime.now() - timedelta(days=1)
+                            parsed_date = yesterday.isoformat() + "Z"
+                            print(f"Using fallback date (yesterday): {parsed_date}")
+                    else:
+                        # Use snippet if we have date from Serper
+                        content = item.get("snippet", "")
+                    
+                    articles.append({
+                        "title": item.get("title", ""),
+                        "content": content,
+                        "url": url,
+                        "source": item.get("source", "Unknown"),
+                        "publishDate": parsed_date
+                    })
+
+                new_urls = len(seen_urls) - urls_before
+                await asyncio.to_thread(planner.record, country, lang, variant_type, new_urls)
+                recent_new_urls.append(new_urls)
+            except QuotaExceededError as e:
+                # Nothing fetched yet: let the endpoint answer 429; otherwise return what we have
+                if not articles:
+                    raise
+                mark_partial(str(e))
+                break
+            except Exception as e:
+                print(f"Error fetching query '{q}' with lang '{lang}': {e}")
+    except QuotaExceededError:
+        raise
     except Exception as e:
         print(f"Error initializing client: {e}")
 
@@ -0,0 +1,140 @@
+import os
+import json
+import random
+import threading
+from typing import Dict, List, Tuple
+from shared_store import get_store
+
+# Languages each query variant may be sent with (Serper "hl")
+LANGUAGES = ["en", "hi", "auto"]
+
+# Stats now live in the shared store so all workers learn from each other; a stats file
+# left by earlier versions is imported once on startup
+LEGACY_STATS_PATH = os.getenv(
+    "QUERY_PLANNER_STATS_PATH",
+    os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "query_planner_stats.json")),
+)
+# Optimistic prior so unseen (country, language, variant type) combinations get tried
+PRIOR_CALLS = 1.0
+PRIOR_NEW_URLS = float(os.getenv("QUERY_PLANNER_PRIOR_NEW_URLS", "10"))
+# Older observations fade so the planner follows changes in Serper's coverage
+DECAY = float(os.getenv("QUERY_PLANNER_DECAY", "0.98"))
+# Combinations averaging fewer new URLs than this (after enough samples) are pruned
+PRUNE_BELOW_NEW_URLS = float(os.getenv("QUERY_PLANNER_PRUNE_BELOW", "1"))
+MIN_SAMPLES_TO_PRUNE = float(os.getenv("QUERY_PLANNER_MIN_SAMPLES", "5"))
+# Share of pruned combinations still run, to keep their stats current
+EXPLORE_RATE = float(os.getenv("QUERY_PLANNER_EXPLORE_RATE", "0.1"))
+# Stop a search once recent calls and the next planned call fall below this many new URLs
+STOP_BELOW_NEW_URLS = float(os.getenv("QUERY_PLANNER_STOP_BELOW", "2"))
+STOP_WINDOW = 3
+
+
+class QueryPlanner:
+    """
+    Orders Serper (query variant, language) calls by their expected number of new URLs.
+    Yield is tracked per (country, language, variant type) in the shared store; each plan
+    works from a fresh snapshot of the country's stats.
+    """
+
+    def __init__(self, legacy_path: str = LEGACY_STATS_PATH):
+        self.lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self.import_legacy(legacy_path)
+
+    @staticmethod
+    def _key(country: str, lang: str, variant_type: str) -> str:
+        return f"{country}|{lang}|{variant_type}"
+
+    @staticmethod
+    def import_legacy(path: str):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                stats = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Error reading legacy query planner stats: {e}")
+            return
+        try:
+            get_store().planner_import(stats)
+            os.replace(path, f"{path}.imported")
+            print(f"Imported query planner stats for {len(stats)} combinations")
+        except Exception as e:
+            print(f"Error importing legacy query planner stats: {e}")
+
+    def load(self, country: str):
+        """Refresh the snapshot of one country's stats from the shared store."""
+        try:
+            fresh = get_store().planner_stats(f"{country}|")
+        except Exception as e:
+            print(f"Error loading query planner stats: {e}")
+            return
+        with self.lock:
+            self.stats.update(fresh)
+
+    def samples(self, country: str, lang: str, variant_type: str) -> float:
+        return self.stats.get(self._key(country, lang, variant_type), {}).get("calls", 0.0)
+
+    def expected_yield(self, country: str, lang: str, variant_type: str) -> float:
+        entry = self.stats.get(self._key(country, lang, variant_type), {})
+        calls = entry.get("calls", 0.0)
+        new_urls = entry.get("new_urls", 0.0)
+        return (new_urls + PRIOR_NEW_URLS * PRIOR_CALLS) / (calls + PRIOR_CALLS)
+
+    def record(self, country: str, lang: str, variant_type: str, new_urls: int):
+        key = self._key(country, lang, variant_type)
+        with self.lock:
+            entry = self.stats.setdefault(key, {"calls": 0.0, "new_urls": 0.0})
+            entry["calls"] = entry["calls"] * DECAY + 1
+            entry["new_urls"] = entry["new_urls"] * DECAY + new_urls
+        try:
+            get_store().planner_record(key, new_urls, DECAY)
+        except Exception as e:
+            print(f"Error saving query planner stats: {e}")
+
+    def plan(self, country: str, variants: List[Tuple[str, str]]) -> List[Tuple[str, str, str, float]]:
+        """
+        Turn (query, variant type) pairs into (query, language, variant type, expected yield)
+        calls, highest expected yield first, with proven low-yield combinations pruned.
+        """
+        self.load(country)
+        planned = []
+        seen = set()
+        pruned = 0
+        for index, (query, variant_type) in enumerate(variants):
+            for lang in LANGUAGES:
+                if (query, lang) in seen:
+                    continue
+                seen.add((query, lang))
+                expected = self.expected_yield(country, lang, variant_type)
+                if (
+                    self.samples(country, lang, variant_type) >= MIN_SAMPLES_TO_PRUNE
+                    and expected < PRUNE_BELOW_NEW_URLS
+                    and random.random() >= EXPLORE_RATE
+                ):
+                    pruned += 1
+                    continue
+                planned.append((expected, index, query, lang, variant_type))
+
+        if not planned and variants:
+            # Never skip a search entirely: fall back to the plain entity query
+            query, variant_type = variants[0]
+            planned.append((self.expected_yield(country, "en", variant_type), 0, query, "en", variant_type))
+
+        # Stable on variant order for equal yields so the entity query still leads on a cold start
+        planned.sort(key=lambda p: (-p[0], p[1]))
+        print(f"Query plan for '{country}': {len(planned)} calls, {pruned} pruned")
+        return [(query, lang, variant_type, expected) for expected, _, query, lang, variant_type in planned]
+
+    @staticmethod
+    def should_stop(recent_new_urls: List[int], next_expected: float) -> bool:
+        """Stop once the last few calls and the next planned one all add too few new URLs."""
+        if len(recent_new_urls) < STOP_WINDOW:
+            return False
+        return (
+            max(recent_new_urls[-STOP_WINDOW:]) < STOP_BELOW_NEW_URLS
+            and next_expected < STOP_BELOW_NEW_URLS
+        )
+
+
+planner = QueryPlanner()
@@ -2,8 +2,6 @@ import os
 from datetime import datetime, timedelta
 from typing import Optional
 import jwt
-from google.oauth2 import id_token
-from google.auth.transport import requests
 from fastapi import HTTPException
 from pydantic import BaseModel
 
@@ -21,9 +19,15 @@ class AuthResponse(BaseModel):
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 AUTHORIZED_USERS = os.getenv("AUTHORIZED_USERS", "").split(",")
+# Users who may see operational stats for everyone, not just themselves
+ADMIN_USERS = os.getenv("ADMIN_USERS", "").split(",")
 
 def verify_google_token(credential: str) -> dict:
     """Verify Google OAuth token and return user info."""
+    # google-auth is only needed at sign-in, so keep it out of the import path
+    from google.oauth2 import id_token
+    from google.auth.transport import requests
+
     try:
         # Verify the token
         idinfo = id_token.verify_oauth2_token(
@@ -52,6 +56,10 @@ def check_user_authorization(email: str) -> bool:
     
     return email in authorized_list
 
+def is_admin_user(email: str) -> bool:
+    """Check if user email is in the admin list."""
+    return email in [user.strip() for user in ADMIN_USERS if user.strip()]
+
 def create_jwt_token(user_info: dict) -> str:
     """Create JWT token for authenticated user."""
     payload = {
@@ -0,0 +1,85 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+# Overall time budget for a /search request, in seconds
+SEARCH_DEADLINE_SECONDS = float(os.getenv("SEARCH_DEADLINE_SECONDS", "90"))
+MAX_SEARCH_DEADLINE_SECONDS = float(os.getenv("MAX_SEARCH_DEADLINE_SECONDS", "300"))
+# Bulk screening runs cover many entities, so they get a larger budget
+BULK_SEARCH_DEADLINE_SECONDS = float(os.getenv("BULK_SEARCH_DEADLINE_SECONDS", "1800"))
+MAX_BULK_SEARCH_DEADLINE_SECONDS = float(os.getenv("MAX_BULK_SEARCH_DEADLINE_SECONDS", "3600"))
+# Share of the budget the news fetch may use before analysis has to start
+FETCH_BUDGET_FRACTION = float(os.getenv("SEARCH_FETCH_BUDGET_FRACTION", "0.6"))
+# Shortest timeout handed to an upstream call, so near-expired requests fail fast
+MIN_UPSTREAM_TIMEOUT = 0.5
+
+# Like the scheduler context, these are copied into every task the request spawns,
+# so translation, Serper fan-out, scraping and analysis all see the same deadline.
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+_partial_reasons = contextvars.ContextVar("request_partial_reasons", default=None)
+
+
+def start_deadline(
+    seconds: Optional[float] = None,
+    default: float = SEARCH_DEADLINE_SECONDS,
+    maximum: float = MAX_SEARCH_DEADLINE_SECONDS,
+) -> float:
+    """Start the request's time budget (client value or server default) and return it."""
+    if not seconds or seconds <= 0:
+        seconds = default
+    seconds = min(seconds, maximum)
+    _deadline.set(time.monotonic() + seconds)
+    start_partial_tracking()
+    return seconds
+
+
+def start_partial_tracking():
+    """Collect partial-result reasons separately for the current task, e.g. one bulk entity."""
+    _partial_reasons.set([])
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the request deadline, or None if no deadline is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def timeout_for(default: float) -> float:
+    """Clamp an upstream call's own timeout to what is left of the request budget."""
+    left = remaining()
+    if left is None:
+        return default
+    return max(MIN_UPSTREAM_TIMEOUT, min(default, left))
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """Temporarily tighten the deadline, e.g. to keep budget for a later stage."""
+    current = _deadline.get()
+    scoped = time.monotonic() + seconds
+    token = _deadline.set(scoped if current is None else min(current, scoped))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def mark_partial(reason: str):
+    """Record that work was skipped or cut short because the deadline was reached."""
+    reasons = _partial_reasons.get()
+    if reasons is not None and reason not in reasons:
+        print(f"Deadline reached: {reason}")
+        reasons.append(reason)
+
+
+def partial_reasons() -> list:
+    return list(_partial_reasons.get() or [])
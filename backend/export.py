@@ -0,0 +1,163 @@
+import os
+import io
+import csv
+import asyncio
+import tempfile
+from typing import AsyncIterator, List
+
+# Analysis fields from analyze_article, in spreadsheet column order, with the type each
+# column is coerced to so CSV, XLSX and Parquet all agree.
+EXPORT_COLUMNS = [
+    ("S.No", "int"),
+    ("entity", "str"),
+    ("originalTitle", "str"),
+    ("catchyTitle", "str"),
+    ("url", "str"),
+    ("source", "str"),
+    ("publishDate", "str"),
+    ("subjectMatchScore", "float"),
+    ("sentiment", "str"),
+    ("crimeRelated", "bool"),
+    ("unethicalRelated", "bool"),
+    ("confidence", "float"),
+    ("isPaywalled", "bool"),
+    ("summary", "str"),
+    ("tags", "list"),
+    ("matchedDetails", "list"),
+    ("error", "str"),
+]
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Rows written per chunk / Parquet row group
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "500"))
+FILE_CHUNK_BYTES = 64 * 1024
+# Spreadsheet apps run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _coerce(value, kind: str):
+    if value is None or value == "":
+        return None
+    try:
+        if kind == "int":
+            return int(value)
+        if kind == "float":
+            return float(value)
+        if kind == "bool":
+            if isinstance(value, str):
+                return value.strip().lower() in ("true", "yes", "1")
+            return bool(value)
+        if kind == "list":
+            if isinstance(value, (list, tuple)):
+                return "; ".join(str(v) for v in value)
+            return str(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def _escape_formula(value):
+    # Article text is attacker-controlled; a leading quote makes Excel show it as text
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def to_row(result: dict, spreadsheet: bool = False) -> list:
+    """One export row; `spreadsheet` escapes text cells that would run as formulas (CSV, XLSX)."""
+    row = [_coerce(result.get(name), kind) for name, kind in EXPORT_COLUMNS]
+    return [_escape_formula(v) for v in row] if spreadsheet else row
+
+
+async def _row_batches(results: AsyncIterator[dict], spreadsheet: bool = False) -> AsyncIterator[List[list]]:
+    batch = []
+    async for result in results:
+        batch.append(to_row(result, spreadsheet))
+        if len(batch) >= EXPORT_CHUNK_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _stream_file(f) -> AsyncIterator[bytes]:
+    f.seek(0)
+    while True:
+        chunk = await asyncio.to_thread(f.read, FILE_CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def export_csv(results: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens Hindi and other non-Latin text correctly
+    buffer.write("\ufeff")
+    writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    yield buffer.getvalue().encode("utf-8")
+    async for batch in _row_batches(results, spreadsheet=True):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def export_xlsx(results: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    # Imported here so the API starts without openpyxl loaded
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    # Write-only mode streams rows to a temp file instead of keeping cells in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Results")
+    sheet.append([name for name, _ in EXPORT_COLUMNS])
+    async for batch in _row_batches(results, spreadsheet=True):
+        for row in batch:
+            sheet.append([ILLEGAL_CHARACTERS_RE.sub("", v) if isinstance(v, str) else v for v in row])
+
+    with tempfile.TemporaryFile() as f:
+        await asyncio.to_thread(workbook.save, f)
+        async for chunk in _stream_file(f):
+            yield chunk
+
+
+async def export_parquet(results: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    # Imported here so the API starts without pyarrow loaded
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {"int": pa.int64(), "float": pa.float64(), "bool": pa.bool_(), "str": pa.string(), "list": pa.string()}
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in EXPORT_COLUMNS])
+
+    with tempfile.TemporaryFile() as f:
+        writer = pq.ParquetWriter(f, schema)
+        try:
+            async for batch in _row_batches(results):
+                columns = list(zip(*batch))
+                table = pa.Table.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                    schema=schema,
+                )
+                writer.write_table(table)
+        finally:
+            writer.close()
+        async for chunk in _stream_file(f):
+            yield chunk
+
+
+EXPORTERS = {
+    "csv": export_csv,
+    "xlsx": export_xlsx,
+    "parquet": export_parquet,
+}
+
+
+def export_stream(results: AsyncIterator[dict], fmt: str) -> AsyncIterator[bytes]:
+    """Encode an async stream of analysis results in the requested format, chunk by chunk."""
+    return EXPORTERS[fmt](results)
@@ -0,0 +1,33 @@
+import os
+from typing import Dict
+
+import httpx
+
+# One pooled client per upstream, so connections and TLS sessions are reused across
+# requests instead of being re-established for every Serper or Azure OpenAI call.
+CLIENT_TIMEOUTS = {
+    "serper": 100,
+    "azure_openai": 30,
+}
+MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "64"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "32"))
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Shared client for an upstream ("serper" or "azure_openai"), created on first use."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=CLIENT_TIMEOUTS.get(name, 30),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+        )
+        _clients[name] = client
+    return client
+
+
+async def close_clients():
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
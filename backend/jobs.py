@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+from typing import AsyncIterator, List, Optional
+
+# Finished search results are kept on disk as NDJSON so they can be exported later
+# without re-running the search or holding them in memory.
+JOBS_DIR = os.getenv(
+    "JOBS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "jobs"),
+)
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+JOB_CLEANUP_INTERVAL_SECONDS = int(os.getenv("JOB_CLEANUP_INTERVAL_SECONDS", "3600"))
+READ_CHUNK_BYTES = 1024 * 1024
+
+_JOB_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+
+def job_path(job_id: str) -> Optional[str]:
+    """Path of a stored job, or None if the id is malformed."""
+    if not _JOB_ID_RE.fullmatch(job_id or ""):
+        return None
+    return os.path.join(JOBS_DIR, f"{job_id}.ndjson")
+
+
+class JobWriter:
+    """Appends one search's results to its job file; the first line holds job metadata."""
+
+    def __init__(self, owner: str, description: dict):
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        self.job_id = uuid.uuid4().hex
+        self.file = open(job_path(self.job_id), "w", encoding="utf-8")
+        meta = {"owner": owner, "created": time.time(), **description}
+        self.file.write(json.dumps({"_meta": meta}) + "\n")
+
+    def append(self, results: List[dict], entity: str):
+        for result in results:
+            self.file.write(json.dumps({**result, "entity": entity}, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def save_job(owner: str, entity: str, results: List[dict], description: Optional[dict] = None) -> str:
+    """Store a finished single-entity search and return its job id."""
+    writer = JobWriter(owner, description or {"entity": entity})
+    try:
+        writer.append(results, entity)
+    finally:
+        writer.close()
+    return writer.job_id
+
+
+def read_job_meta(job_id: str) -> Optional[dict]:
+    path = job_path(job_id)
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        first_line = f.readline()
+    try:
+        return json.loads(first_line).get("_meta")
+    except Exception:
+        return None
+
+
+async def iter_job_results(job_id: str) -> AsyncIterator[dict]:
+    """Yield a stored job's results one at a time, reading the file in bounded chunks."""
+    with open(job_path(job_id), "r", encoding="utf-8") as f:
+        await asyncio.to_thread(f.readline)  # skip metadata
+        while True:
+            lines = await asyncio.to_thread(f.readlines, READ_CHUNK_BYTES)
+            if not lines:
+                return
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def cleanup_expired_jobs():
+    try:
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for name in os.listdir(JOBS_DIR):
+            path = os.path.join(JOBS_DIR, name)
+            try:
+                if name.endswith(".ndjson") and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass  # Removed by another worker
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error cleaning up stored jobs: {e}")
+
+
+async def cleanup_jobs_periodically():
+    """Remove expired jobs at startup and then every JOB_CLEANUP_INTERVAL_SECONDS, off the event loop."""
+    while True:
+        await asyncio.to_thread(cleanup_expired_jobs)
+        await asyncio.sleep(JOB_CLEANUP_INTERVAL_SECONDS)
@@ -1,15 +1,47 @@
-from fastapi import FastAPI, HTTPException, Depends
+from startup import warm_up, mark_app_imported, import_report, state as startup_state, WARMUP_ON_STARTUP
+from fastapi import FastAPI, HTTPException, Depends, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
+import os
+import json
+import time
 import asyncio
 from datetime import datetime, timezone
-from api.ms.news import get_all_news_data
-from analyzer import analyze_article
-from auth import authenticate_google_user, GoogleCredential
+from api.ms.news import get_all_news_data, run_shared, translate_tag_union, SharedFetchCache
+from analyzer import analyze_article, parse_stats
+from auth import authenticate_google_user, is_admin_user, GoogleCredential
 from dependencies import get_current_user
+from scheduler import set_request_context, check_user_quota, get_scheduler_stats, release_worker_leases, QuotaExceededError
+from jobs import JobWriter, save_job, read_job_meta, iter_job_results, cleanup_jobs_periodically
+from export import export_stream, EXPORT_FORMATS
+from rollups import query_rollups, DIMENSIONS
+from http_clients import close_clients
+from deadline import (
+    start_deadline, start_partial_tracking, deadline_scope, remaining, mark_partial, partial_reasons,
+    FETCH_BUDGET_FRACTION, BULK_SEARCH_DEADLINE_SECONDS, MAX_BULK_SEARCH_DEADLINE_SECONDS,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so uvicorn serves /health (503 until warm) right away
+    warmup_task = asyncio.create_task(warm_up()) if WARMUP_ON_STARTUP else None
+    cleanup_task = asyncio.create_task(cleanup_jobs_periodically())
+    yield
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    cleanup_task.cancel()
+    await release_worker_leases()
+    await close_clients()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# How often a running search checks whether the client has gone away
+DISCONNECT_POLL_SECONDS = 0.5
+# Entities of one bulk search that run their pipelines at the same time
+BULK_ENTITY_CONCURRENCY = int(os.getenv("BULK_ENTITY_CONCURRENCY", "4"))
 
 # Add CORS middleware
 app.add_middleware(
@@ -30,6 +62,18 @@ class MediaSearchInput(BaseModel):
     country: str
     tags: Optional[List[str]] = []
     date_range: Optional[DateRange] = None
+    priority: Optional[str] = "interactive"  # "interactive" or "bulk"
+    timeout_seconds: Optional[float] = None  # overall budget; server default if omitted
+
+class BulkSearchEntry(BaseModel):
+    entity: str
+    country: str
+    tags: Optional[List[str]] = []
+
+class BulkSearchInput(BaseModel):
+    entries: List[BulkSearchEntry]
+    date_range: Optional[DateRange] = None
+    timeout_seconds: Optional[float] = None  # budget for the whole run; server default if omitted
 
 def filter_articles_by_date(articles, date_range):
     """Filter articles to only include those within the specified date range."""
@@ -134,56 +178,305 @@ def filter_articles_by_date(articles, date_range):
 async def root():
     return {"message": "Media Search API is running"}
 
-@app.post("/search")
-async def search_media(input_data: MediaSearchInput, current_user: dict = Depends(get_current_user)):
-    """Protected search endpoint - requires authentication."""
-    try:
-        print(f"Search request from user: {current_user['email']}")
-        
-        # Your existing search logic remains the same
-        query = {
-            "query": input_data.entity,
-            "advanced_options": {
-                "country": [input_data.country],
-                "detailed_query": input_data.tags or [],
-                "date_range": input_data.date_range.dict() if input_data.date_range else None
-            }
+@app.get("/health")
+async def health():
+    """Readiness check - 503 until the optional startup warm-up has finished."""
+    if not startup_state["warm"]:
+        return JSONResponse(status_code=503, content={"status": "warming"})
+    return {"status": "ok"}
+
+@app.get("/startup/report")
+async def startup_report(current_user: dict = Depends(get_current_user)):
+    """Protected import-time and warm-up report for this worker."""
+    return import_report()
+
+async def run_search(input_data: MediaSearchInput, owner: str) -> dict:
+    """Fetch and analyze articles within the request deadline, returning what finished in time."""
+    start_deadline(input_data.timeout_seconds)
+    response = await search_pipeline(input_data)
+    if response["results"]:
+        # Keep the results on disk so they can be exported without re-running the search
+        response["jobId"] = await asyncio.to_thread(save_job, owner, input_data.entity, response["results"])
+    return response
+
+async def fetch_entity_articles(
+    input_data: MediaSearchInput, cache: Optional[SharedFetchCache] = None, translations: Optional[dict] = None
+) -> Optional[list]:
+    """Fetch one entity's articles; None if nothing was found, [] if the date filter removed them all."""
+    query = {
+        "query": input_data.entity,
+        "advanced_options": {
+            "country": [input_data.country],
+            "detailed_query": input_data.tags or [],
+            "date_range": input_data.date_range.dict() if input_data.date_range else None
         }
+    }
+
+    # Leave part of the budget for analysis so a slow fetch still yields results
+    with deadline_scope(max(remaining(), 0) * FETCH_BUDGET_FRACTION):
+        articles = await get_all_news_data(query=query, cache=cache, translations=translations)
 
-        articles = await get_all_news_data(query=query)
+    if not articles:
+        return None
 
-        if not articles:
-            return {"results": []}
+    # Apply strict date filtering after getting results from Serper API
+    if input_data.date_range:
+        articles = filter_articles_by_date(articles, input_data.date_range)
+        print(f"After date filtering: {len(articles)} articles remaining")
 
-        # Apply strict date filtering after getting results from Serper API
-        if input_data.date_range:
-            articles = filter_articles_by_date(articles, input_data.date_range)
-            print(f"After date filtering: {len(articles)} articles remaining")
+    return [article.dict() if hasattr(article, "dict") else article for article in articles]
 
-        if not articles:
-            return {"results": [], "message": "No articles found within the specified date range"}
+def analysis_key(entity: str, article: dict) -> Optional[tuple]:
+    """Key an analysis is shared under; articles without a URL can't be told apart, so they get none."""
+    return (entity, article["url"]) if article.get("url") else None
 
-        # Step 2: Analyze each article
-        tasks = [
-            analyze_article(
+def start_analyses(input_data: MediaSearchInput, articles: list, cache: Optional[SharedFetchCache] = None) -> list:
+    return [
+        asyncio.create_task(run_shared(
+            cache, "analysis", analysis_key(input_data.entity, article),
+            lambda article=article: analyze_article(
                 entity_name=input_data.entity,
                 entity_description="",
-                article=article.dict() if hasattr(article, "dict") else article
+                article=article
             )
-            for article in articles
-        ]
+        ))
+        for article in articles
+    ]
 
-        results = await asyncio.gather(*tasks)
-        
-        # Add serial numbers
-        for i, result in enumerate(results):
-            result["S.No"] = i + 1
+async def search_pipeline(
+    input_data: MediaSearchInput, cache: Optional[SharedFetchCache] = None, translations: Optional[dict] = None
+) -> dict:
+    """Fetch, date-filter and analyze one entity's articles under the current deadline."""
+    articles = await fetch_entity_articles(input_data, cache, translations)
+    if articles is None:
+        return {"results": [], **deadline_status()}
+    if not articles:
+        return {"results": [], "message": "No articles found within the specified date range", **deadline_status()}
+
+    # Step 2: Analyze each article
+    tasks = start_analyses(input_data, articles, cache)
+
+    done, pending = await asyncio.wait(tasks, timeout=max(remaining(), 0))
+    if pending:
+        mark_partial(f"{len(pending)} of {len(tasks)} article analyses unfinished")
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    # Copy so results shared between bulk entries don't share serial numbers
+    results = []
+    quota_error = None
+    for task in tasks:
+        if task not in done:
+            continue
+        if isinstance(task.exception(), QuotaExceededError):
+            quota_error = task.exception()
+            continue
+        results.append(dict(task.result()))
+    if quota_error:
+        if not results:
+            raise quota_error
+        mark_partial(str(quota_error))
+
+    # Add serial numbers
+    for i, result in enumerate(results):
+        result["S.No"] = i + 1
+
+    return {"results": results, **deadline_status()}
+
+async def iter_analysis_results(input_data: MediaSearchInput, articles: list) -> AsyncIterator[dict]:
+    """Yield analysis results as they finish, so exports never hold the whole result set.
+
+    If the export was cut short, a last row with only `entity` and `error` says why.
+    """
+    # Only unfinished tasks are kept, so each result can be freed once it is written out
+    pending = set(start_analyses(input_data, articles))
+    serial = 0
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(remaining(), 0), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                mark_partial(f"{len(pending)} article analyses unfinished")
+                break
+            for task in done:
+                if isinstance(task.exception(), QuotaExceededError):
+                    mark_partial(str(task.exception()))
+                    continue
+                serial += 1
+                yield {**task.result(), "S.No": serial, "entity": input_data.entity}
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    reasons = partial_reasons()
+    if reasons:
+        yield {"entity": input_data.entity, "error": "Export incomplete: " + "; ".join(reasons)}
+
+def deadline_status() -> dict:
+    reasons = partial_reasons()
+    return {"partial": bool(reasons), "partialReasons": reasons}
+
+async def cancel_on_disconnect(request: Request, work) -> Optional[dict]:
+    """Run a search coroutine, cancelling it promptly if the client disconnects."""
+    task = asyncio.create_task(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                print("Client disconnected, cancelling outstanding search work")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
+
+@app.post("/search")
+async def search_media(input_data: MediaSearchInput, request: Request, current_user: dict = Depends(get_current_user)):
+    """Protected search endpoint - requires authentication."""
+    try:
+        print(f"Search request from user: {current_user['email']}")
+
+        # Fair-queue this request's upstream calls under the caller's identity
+        set_request_context(current_user, input_data.priority)
+        await asyncio.to_thread(check_user_quota, current_user["email"])
 
-        return {"results": results}
+        response = await cancel_on_disconnect(request, run_search(input_data, current_user["email"]))
+        if response is None:
+            return {"results": [], "partial": True, "partialReasons": ["client disconnected"]}
+        return response
 
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def stream_bulk_search(input_data: BulkSearchInput, current_user: dict):
+    """Run every entry of a bulk search over shared fetch work, yielding one NDJSON line per entity."""
+    set_request_context(current_user, "bulk")
+    start_deadline(input_data.timeout_seconds, BULK_SEARCH_DEADLINE_SECONDS, MAX_BULK_SEARCH_DEADLINE_SECONDS)
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(BULK_ENTITY_CONCURRENCY)
+    job = await asyncio.to_thread(JobWriter, current_user["email"], {"entities": [entry.entity for entry in input_data.entries]})
+
+    async with SharedFetchCache() as cache:
+        # One translation call per target language for all entries' tags, not one per tag list
+        try:
+            translations = await translate_tag_union(
+                [(entry.country, entry.tags or []) for entry in input_data.entries], cache
+            )
+        except Exception as e:
+            print(f"Bulk tag translation failed, entries translate their own tags: {e}")
+            translations = {}
+
+        async def search_entry(index: int, entry: BulkSearchEntry) -> dict:
+            async with semaphore:
+                start_partial_tracking()
+                entry_input = MediaSearchInput(
+                    entity=entry.entity,
+                    country=entry.country,
+                    tags=entry.tags or [],
+                    date_range=input_data.date_range,
+                    priority="bulk",
+                )
+                try:
+                    response = await search_pipeline(entry_input, cache, translations)
+                except Exception as e:
+                    print(f"Bulk search error for {entry.entity}: {e}")
+                    response = {"results": [], "error": str(e)}
+                return {"index": index, "entity": entry.entity, "country": entry.country, **response}
+
+        tasks = [asyncio.create_task(search_entry(i, entry)) for i, entry in enumerate(input_data.entries)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                await asyncio.to_thread(job.append, line["results"], line["entity"])
+                yield json.dumps(line) + "\n"
+            yield json.dumps({
+                "done": True,
+                "jobId": job.job_id,
+                "entities": len(tasks),
+                "elapsedSeconds": round(time.monotonic() - started, 2),
+                "sharedWork": cache.stats(),
+            }) + "\n"
+        finally:
+            # Client went away or the stream failed: stop outstanding entity work
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(job.close)
+
+@app.post("/search/bulk")
+async def bulk_search(input_data: BulkSearchInput, current_user: dict = Depends(get_current_user)):
+    """Protected bulk search - streams results per entity as newline-delimited JSON."""
+    print(f"Bulk search request from user: {current_user['email']} ({len(input_data.entries)} entities)")
+    try:
+        await asyncio.to_thread(check_user_quota, current_user["email"])
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return StreamingResponse(stream_bulk_search(input_data, current_user), media_type="application/x-ndjson")
+
+def export_response(rows: AsyncIterator[dict], fmt: str, name: str) -> StreamingResponse:
+    return StreamingResponse(
+        export_stream(rows, fmt),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'},
+    )
+
+@app.get("/export/{job_id}")
+async def export_job(job_id: str, format: str = Query("csv", pattern="^(csv|xlsx|parquet)$"), current_user: dict = Depends(get_current_user)):
+    """Protected export of a stored search (jobId from /search or /search/bulk)."""
+    meta = read_job_meta(job_id)
+    if not meta or meta.get("owner") != current_user["email"]:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return export_response(iter_job_results(job_id), format, f"search-{job_id}")
+
+@app.post("/export")
+async def export_search(input_data: MediaSearchInput, format: str = Query("csv", pattern="^(csv|xlsx|parquet)$"), current_user: dict = Depends(get_current_user)):
+    """Protected export that runs a search and writes rows out as analyses finish."""
+    print(f"Export request from user: {current_user['email']} ({format})")
+    # The streamed response runs in this context, so analyses inherit the caller and deadline.
+    # An export is a download rather than an interactive page, so it gets the bulk budget.
+    set_request_context(current_user, input_data.priority)
+    start_deadline(input_data.timeout_seconds, BULK_SEARCH_DEADLINE_SECONDS, MAX_BULK_SEARCH_DEADLINE_SECONDS)
+    try:
+        await asyncio.to_thread(check_user_quota, current_user["email"])
+        # Fetch before the response starts, so a refused quota is still a 429 and not a broken download
+        articles = await fetch_entity_articles(input_data)
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    return export_response(iter_analysis_results(input_data, articles or []), format, "search-export")
+
+@app.get("/analytics/rollups")
+async def analytics_rollups(
+    dimension: str = Query("sentiment"),
+    entity: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    by_day: bool = True,
+    limit: Optional[int] = Query(None, ge=1),
+    current_user: dict = Depends(get_current_user),
+):
+    """Protected dashboard aggregates from precomputed rollups of analysis results."""
+    if dimension not in DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"dimension must be one of {DIMENSIONS}")
+    return await query_rollups(dimension, entity=entity, from_date=from_date, to_date=to_date, by_day=by_day, limit=limit)
+
+@app.get("/analyzer/stats")
+async def analyzer_stats(current_user: dict = Depends(get_current_user)):
+    """Protected counters for model-output parse failures, local repairs and re-asks."""
+    return parse_stats()
+
+@app.get("/scheduler/stats")
+async def scheduler_stats(current_user: dict = Depends(get_current_user)):
+    """Queue depth, wait times and quota usage for upstream capacity; admins see every user."""
+    email = current_user["email"]
+    return await get_scheduler_stats(None if is_admin_user(email) else email)
+
 @app.post("/auth/google")
 async def google_auth(credential: GoogleCredential):
     """Handle Google OAuth authentication."""
@@ -193,6 +486,8 @@ async def google_auth(credential: GoogleCredential):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+mark_app_imported()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,177 @@
+import os
+import re
+import sqlite3
+import asyncio
+import threading
+from typing import Optional
+
+# Dashboard aggregates (sentiment over time, source mix, crime/unethical flags, tags) are
+# kept as running counts per (entity, day, dimension, value), updated as each analysis
+# finishes, so charts never have to rescan articles.
+ANALYTICS_DB_PATH = os.getenv(
+    "ANALYTICS_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "analytics.db"),
+)
+DIMENSIONS = ["total", "sentiment", "source", "crimeRelated", "unethicalRelated", "tag"]
+
+_DAY_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})")
+# Day bucket for results without a parseable publish date
+UNKNOWN_DAY = "unknown"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup (
+    entity TEXT NOT NULL,
+    day TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (entity, dimension, day, value)
+);
+CREATE INDEX IF NOT EXISTS rollup_dimension_day ON rollup (dimension, day);
+CREATE TABLE IF NOT EXISTS rollup_seen (
+    entity TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (entity, url)
+);
+"""
+
+
+def entity_key(entity: str) -> str:
+    return " ".join((entity or "").lower().split())
+
+
+def _day(publish_date) -> str:
+    match = _DAY_RE.match(str(publish_date or ""))
+    return match.group(1) if match else UNKNOWN_DAY
+
+
+def _flag(value) -> str:
+    if isinstance(value, str):
+        return "true" if value.strip().lower() == "true" else "false"
+    return "true" if value else "false"
+
+
+def rollup_rows(result: dict) -> list:
+    """The (dimension, value) pairs one analysis result adds a count to."""
+    rows = [
+        ("total", "all"),
+        ("sentiment", str(result.get("sentiment") or "neutral").lower()),
+        ("source", str(result.get("source") or "Unknown")),
+        ("crimeRelated", _flag(result.get("crimeRelated"))),
+        ("unethicalRelated", _flag(result.get("unethicalRelated"))),
+    ]
+    tags = result.get("tags") or []
+    if isinstance(tags, str):
+        tags = [tags]
+    for tag in {str(t).strip().lower() for t in tags if str(t).strip()}:
+        rows.append(("tag", tag))
+    return rows
+
+
+class RollupStore:
+    def __init__(self, path: str = ANALYTICS_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def record(self, entity: str, result: dict) -> bool:
+        """Add one analysis to the rollups; each (entity, article URL) is only counted once."""
+        key = entity_key(entity)
+        url = result.get("url") or ""
+        day = _day(result.get("publishDate"))
+        with self.lock, self.conn:
+            if url:
+                inserted = self.conn.execute(
+                    "INSERT OR IGNORE INTO rollup_seen (entity, url) VALUES (?, ?)", (key, url)
+                ).rowcount
+                if not inserted:
+                    return False
+            self.conn.executemany(
+                """
+                INSERT INTO rollup (entity, day, dimension, value, count) VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT (entity, dimension, day, value) DO UPDATE SET count = count + 1
+                """,
+                [(key, day, dimension, value) for dimension, value in rollup_rows(result)],
+            )
+        return True
+
+    def query(
+        self,
+        dimension: str,
+        entity: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        by_day: bool = True,
+        limit: Optional[int] = None,
+    ) -> dict:
+        """Counts for one dimension, per day or in total, optionally for one entity and date range."""
+        where = ["dimension = ?"]
+        params = [dimension]
+        if entity:
+            where.append("entity = ?")
+            params.append(entity_key(entity))
+        if from_date or to_date:
+            # Undated results aren't in any date range ("unknown" would sort after every date)
+            where.append("day != ?")
+            params.append(UNKNOWN_DAY)
+        if from_date:
+            where.append("day >= ?")
+            params.append(from_date)
+        if to_date:
+            where.append("day <= ?")
+            params.append(to_date)
+        clause = " AND ".join(where)
+
+        with self.lock:
+            totals = self.conn.execute(
+                f"SELECT value, SUM(count) AS n FROM rollup WHERE {clause} GROUP BY value ORDER BY n DESC"
+                + (" LIMIT ?" if limit else ""),
+                params + ([limit] if limit else []),
+            ).fetchall()
+            series_rows = []
+            if by_day:
+                values = [value for value, _ in totals]
+                series_rows = self.conn.execute(
+                    f"SELECT day, value, SUM(count) FROM rollup WHERE {clause} "
+                    f"AND value IN ({','.join('?' * len(values))}) GROUP BY day, value ORDER BY day",
+                    params + values,
+                ).fetchall() if values else []
+
+        series = {}
+        for day, value, count in series_rows:
+            series.setdefault(day, {})[value] = count
+        return {
+            "dimension": dimension,
+            "entity": entity,
+            "totals": {value: count for value, count in totals},
+            "series": [{"day": day, "counts": counts} for day, counts in series.items()] if by_day else None,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> RollupStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RollupStore()
+        return _store
+
+
+async def record_analysis(entity: str, result: dict):
+    """Fold a finished analysis into the rollups without blocking the event loop."""
+    if "error" in result:
+        return
+    try:
+        await asyncio.to_thread(get_store().record, entity, result)
+    except Exception as e:
+        print(f"Error updating analytics rollups: {e}")
+
+
+async def query_rollups(dimension: str, **filters) -> dict:
+    return await asyncio.to_thread(get_store().query, dimension, **filters)
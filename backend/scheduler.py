@@ -0,0 +1,330 @@
+import os
+import time
+import uuid
+import asyncio
+import contextvars
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from deadline import remaining
+from shared_store import WORKER_COUNT, get_store
+
+# Every /search shares one Serper key and one Azure deployment, so outbound work is
+# queued per (user, priority) flow and released in weighted fair order.
+# The user and priority ride along in context variables, which asyncio copies into
+# every task created by gather(), so news.py and analyzer.py need no extra arguments.
+current_user_id = contextvars.ContextVar("current_user_id", default="anonymous")
+current_priority = contextvars.ContextVar("current_priority", default="interactive")
+
+PRIORITY_WEIGHTS = {
+    "interactive": float(os.getenv("SCHED_INTERACTIVE_WEIGHT", "4")),
+    "bulk": float(os.getenv("SCHED_BULK_WEIGHT", "1")),
+}
+
+# Total concurrent upstream calls per resource, shared by all users and all workers:
+# each call holds a lease in the shared store, so the limit is node-wide
+RESOURCE_CAPACITY = {
+    "serper": int(os.getenv("SCHED_SERPER_CONCURRENCY", "8")),
+    "scrape": int(os.getenv("SCHED_SCRAPE_CONCURRENCY", "8")),
+    "llm": int(os.getenv("SCHED_LLM_CONCURRENCY", "16")),
+}
+
+# Concurrent upstream calls a single user may hold per resource (also node-wide)
+USER_CONCURRENCY = {
+    "serper": int(os.getenv("SCHED_USER_SERPER_CONCURRENCY", "4")),
+    "scrape": int(os.getenv("SCHED_USER_SCRAPE_CONCURRENCY", "4")),
+    "llm": int(os.getenv("SCHED_USER_LLM_CONCURRENCY", "8")),
+}
+
+# Upstream calls a single user may start per quota window (0 disables the quota).
+# Usage is counted in the shared store, so the budget holds across all workers.
+USER_QUOTA = {
+    "serper": int(os.getenv("SCHED_USER_SERPER_QUOTA", "1000")),
+    "scrape": int(os.getenv("SCHED_USER_SCRAPE_QUOTA", "2000")),
+    "llm": int(os.getenv("SCHED_USER_LLM_QUOTA", "5000")),
+}
+QUOTA_WINDOW_SECONDS = int(os.getenv("SCHED_QUOTA_WINDOW_SECONDS", "3600"))
+
+# A lease outlives any upstream call; this only matters if a worker dies holding one
+LEASE_TTL_SECONDS = int(os.getenv("SCHED_LEASE_TTL_SECONDS", "300"))
+LEASE_POLL_SECONDS = 0.02
+LEASE_POLL_MAX_SECONDS = 0.5
+
+# Fire-and-forget lease releases, referenced until they finish
+_background = set()
+
+
+class QuotaExceededError(Exception):
+    """Raised when a user has used up their upstream quota for the current window."""
+
+    def __init__(self, user_id: str, resource: str, retry_after: int):
+        self.user_id = user_id
+        self.resource = resource
+        self.retry_after = retry_after
+        super().__init__(f"{resource} quota exceeded for {user_id}, retry in {retry_after}s")
+
+
+def _release_lease(lease_id: str):
+    # Never awaited, so a cancellation can't leave the lease behind
+    task = asyncio.ensure_future(asyncio.to_thread(get_store().lease_release, lease_id))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+class _Waiter:
+    __slots__ = ("user_id", "flow", "start_tag", "finish_tag", "future", "enqueued_at")
+
+    def __init__(self, user_id, flow, start_tag, finish_tag, future):
+        self.user_id = user_id
+        self.flow = flow
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class FairQueue:
+    """
+    Start-time fair queue for one upstream resource.
+    Each (user, priority) pair is a flow; a waiter's finish tag advances by 1/weight,
+    and the free slot always goes to the eligible flow head with the smallest tag.
+    A user at their concurrency limit is skipped until one of their calls finishes.
+    A dispatched call then takes a lease in the shared store, so capacity and per-user
+    limits hold across all workers on the node; while it polls for one, callers of a lower
+    priority in other workers leave free slots to it.
+    """
+
+    def __init__(self, name: str, capacity: int, user_limit: int, quota: int):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.user_limit = max(1, user_limit)
+        self.quota = quota
+        self.virtual_time = 0.0
+        self.in_flight = 0
+        self.flows: Dict[tuple, deque] = {}
+        self.flow_finish: Dict[tuple, float] = {}
+        self.user_in_flight: Dict[str, int] = defaultdict(int)
+        self.user_stats: Dict[str, dict] = defaultdict(
+            lambda: {"dispatched": 0, "total_wait": 0.0, "max_wait": 0.0}
+        )
+
+    def _quota_used(self, user_id: str) -> int:
+        return get_store().quota_used(user_id, self.name, QUOTA_WINDOW_SECONDS)[0]
+
+    def check_quota(self, user_id: str):
+        if self.quota <= 0:
+            return
+        used, oldest = get_store().quota_used(user_id, self.name, QUOTA_WINDOW_SECONDS)
+        if used >= self.quota:
+            retry_after = int(QUOTA_WINDOW_SECONDS - (time.time() - oldest)) + 1
+            raise QuotaExceededError(user_id, self.name, retry_after)
+
+    async def _consume_quota(self, user_id: str):
+        if self.quota <= 0:
+            return
+        allowed, retry_after = await asyncio.to_thread(
+            get_store().quota_consume, user_id, self.name, self.quota, QUOTA_WINDOW_SECONDS
+        )
+        if not allowed:
+            raise QuotaExceededError(user_id, self.name, retry_after)
+
+    def _tag(self, flow: tuple, priority: str):
+        weight = PRIORITY_WEIGHTS.get(priority, 1.0) or 1.0
+        start = max(self.virtual_time, self.flow_finish.get(flow, 0.0))
+        finish = start + 1.0 / weight
+        self.flow_finish[flow] = finish
+        return start, finish
+
+    def _record_dispatch(self, user_id: str, waited: float):
+        stats = self.user_stats[user_id]
+        stats["dispatched"] += 1
+        stats["total_wait"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+        self.in_flight += 1
+        self.user_in_flight[user_id] += 1
+
+    def _dispatch(self):
+        while self.in_flight < self.capacity:
+            best = None
+            for flow, waiters in self.flows.items():
+                if not waiters or self.user_in_flight.get(flow[0], 0) >= self.user_limit:
+                    continue
+                if best is None or waiters[0].finish_tag < best.finish_tag:
+                    best = waiters[0]
+            if best is None:
+                return
+            waiters = self.flows[best.flow]
+            waiters.popleft()
+            if not waiters:
+                del self.flows[best.flow]
+            self.virtual_time = max(self.virtual_time, best.start_tag)
+            self._record_dispatch(best.user_id, time.monotonic() - best.enqueued_at)
+            best.future.set_result(None)
+
+    async def acquire(self, user_id: str, priority: str) -> str:
+        """Wait for a local fair-queued slot, then a node-wide lease; returns the lease id."""
+        await self._wait_for_slot(user_id, priority)
+        lease_id = None
+        try:
+            lease_id = await self._acquire_lease(user_id, PRIORITY_WEIGHTS.get(priority, 1.0))
+            # Quota is only charged for calls that actually get a slot
+            await self._consume_quota(user_id)
+        except BaseException:
+            self.release(user_id, lease_id)
+            raise
+        return lease_id
+
+    async def _acquire_lease(self, user_id: str, weight: float) -> str:
+        # Local fair order decides who polls; the shared store caps calls across all workers
+        # and holds lower-weight pollers back while higher-weight ones wait elsewhere
+        store = get_store()
+        lease_id = uuid.uuid4().hex
+        delay = LEASE_POLL_SECONDS
+        while True:
+            attempt = asyncio.ensure_future(asyncio.to_thread(
+                store.lease_acquire, self.name, user_id, lease_id, self.capacity, self.user_limit,
+                LEASE_TTL_SECONDS, weight,
+            ))
+            try:
+                if await asyncio.shield(attempt):
+                    return lease_id
+            except asyncio.CancelledError:
+                # The attempt may still take the lease after we're gone; give it back once it finishes
+                attempt.add_done_callback(lambda _: _release_lease(lease_id))
+                raise
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # Stop holding back lower-priority callers in other workers
+                _release_lease(lease_id)
+                raise
+            delay = min(delay * 2, LEASE_POLL_MAX_SECONDS)
+
+    async def _wait_for_slot(self, user_id: str, priority: str):
+        flow = (user_id, priority)
+        start, finish = self._tag(flow, priority)
+        waiter = _Waiter(user_id, flow, start, finish, asyncio.get_running_loop().create_future())
+        self.flows.setdefault(flow, deque()).append(waiter)
+        self._dispatch()
+        if waiter.future.done():
+            return
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Slot was granted just before we were cancelled; hand it on
+                self.release(user_id, None)
+            else:
+                waiters = self.flows.get(flow)
+                if waiters and waiter in waiters:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self.flows[flow]
+            raise
+
+    def release(self, user_id: str, lease_id: Optional[str]):
+        if lease_id:
+            _release_lease(lease_id)
+        self.in_flight -= 1
+        self.user_in_flight[user_id] -= 1
+        if self.user_in_flight[user_id] <= 0:
+            del self.user_in_flight[user_id]
+        self._dispatch()
+        if not self.flows and self.in_flight == 0:
+            # Fully idle: start the next busy period with a clean virtual clock
+            self.flow_finish.clear()
+            self.virtual_time = 0.0
+            return
+        # Forget finish tags of idle flows that the virtual clock has passed
+        for flow in [f for f, tag in self.flow_finish.items() if f not in self.flows and tag <= self.virtual_time]:
+            del self.flow_finish[flow]
+
+    def _store_stats(self, user_ids: list) -> tuple:
+        quota_used = {user_id: self._quota_used(user_id) for user_id in user_ids} if self.quota > 0 else {}
+        return quota_used, get_store().leases_in_use(self.name)
+
+    async def stats(self, only_user: Optional[str] = None) -> dict:
+        now = time.monotonic()
+        queued = defaultdict(int)
+        oldest_wait = defaultdict(float)
+        for (user_id, _), waiters in self.flows.items():
+            queued[user_id] += len(waiters)
+            if waiters:
+                oldest_wait[user_id] = max(oldest_wait[user_id], now - waiters[0].enqueued_at)
+
+        users = {}
+        for user_id in set(self.user_stats) | set(queued) | set(self.user_in_flight):
+            if only_user is not None and user_id != only_user:
+                continue
+            stats = self.user_stats[user_id]
+            dispatched = stats["dispatched"]
+            users[user_id] = {
+                "queued": queued[user_id],
+                "inFlight": self.user_in_flight.get(user_id, 0),
+                "dispatched": dispatched,
+                "avgWaitSeconds": round(stats["total_wait"] / dispatched, 3) if dispatched else 0.0,
+                "maxWaitSeconds": round(stats["max_wait"], 3),
+                "oldestQueuedSeconds": round(oldest_wait[user_id], 3),
+                "quotaUsed": None,
+                "quotaLimit": self.quota or None,
+            }
+        in_flight = self.in_flight
+
+        # Quota usage and node-wide leases are SQLite reads, so they run off the event loop
+        quota_used, node_in_flight = await asyncio.to_thread(self._store_stats, list(users))
+        for user_id, used in quota_used.items():
+            users[user_id]["quotaUsed"] = used
+        return {
+            "workers": WORKER_COUNT,
+            "capacity": self.capacity,
+            "nodeInFlight": node_in_flight,
+            "inFlight": in_flight,
+            "queued": sum(queued.values()),
+            "users": users,
+        }
+
+
+QUEUES = {
+    name: FairQueue(name, RESOURCE_CAPACITY[name], USER_CONCURRENCY[name], USER_QUOTA[name])
+    for name in RESOURCE_CAPACITY
+}
+
+
+def set_request_context(user: Optional[dict], priority: str = "interactive"):
+    """Bind the calling user and priority class to the current request's upstream calls."""
+    user_id = (user or {}).get("email") or "anonymous"
+    current_user_id.set(user_id)
+    current_priority.set(priority if priority in PRIORITY_WEIGHTS else "interactive")
+
+
+def check_user_quota(user_id: str):
+    """Raise QuotaExceededError if the user has no quota left on any upstream resource."""
+    for queue in QUEUES.values():
+        queue.check_quota(user_id)
+
+
+@asynccontextmanager
+async def upstream_slot(resource: str):
+    """Hold one fair-queued slot on an upstream resource ("serper", "scrape" or "llm")."""
+    queue = QUEUES[resource]
+    user_id = current_user_id.get()
+    # Never queue past the request deadline; wait_for cancels the waiter cleanly
+    left = remaining()
+    lease_id = await asyncio.wait_for(
+        queue.acquire(user_id, current_priority.get()), timeout=max(left, 0) if left is not None else None
+    )
+    try:
+        yield
+    finally:
+        queue.release(user_id, lease_id)
+
+
+async def release_worker_leases():
+    """On shutdown: finish pending lease releases and drop anything this worker still holds."""
+    await asyncio.gather(*_background, return_exceptions=True)
+    await asyncio.to_thread(get_store().release_owned)
+
+
+async def get_scheduler_stats(only_user: Optional[str] = None) -> dict:
+    """Per-resource and per-user queue depth, in-flight calls, wait times and quota usage (one user's, if given)."""
+    return {name: await queue.stats(only_user) for name, queue in QUEUES.items()}
@@ -0,0 +1,60 @@
+import os
+import math
+
+import uvicorn
+
+# Workers per CPU core; CPU-bound work (date parsing, JSON handling, extraction) only
+# scales across cores with one process per core
+WORKERS_PER_CORE = float(os.getenv("WORKERS_PER_CORE", "1"))
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "0"))
+
+
+def _cgroup_cpu_limit():
+    """CPUs allowed by the container's cgroup quota (v2, then v1), or None if unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """CPUs this process can actually use: affinity mask, further limited by a cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit:
+        cpus = min(cpus, math.ceil(limit))
+    return max(1, cpus)
+
+
+def worker_count() -> int:
+    """WEB_CONCURRENCY if set, otherwise available CPUs times WORKERS_PER_CORE (capped by MAX_WORKERS)."""
+    if os.getenv("WEB_CONCURRENCY"):
+        return max(1, int(os.environ["WEB_CONCURRENCY"]))
+    workers = max(1, int(available_cpus() * WORKERS_PER_CORE))
+    return min(workers, MAX_WORKERS) if MAX_WORKERS > 0 else workers
+
+
+if __name__ == "__main__":
+    workers = worker_count()
+    # Workers inherit this and report it on /scheduler/stats
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    print(f"Starting {workers} worker(s)")
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+    )
@@ -0,0 +1,363 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from typing import Optional, Tuple
+
+# State that has to agree across uvicorn workers on one node lives in one SQLite file in
+# WAL mode: upstream concurrency leases, quota usage, in-flight markers, cached upstream
+# results and query planner stats. Each worker process opens its own connection.
+SHARED_STORE_PATH = os.getenv(
+    "SHARED_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "shared_state.db"),
+)
+# Set by serve.py; reported on /scheduler/stats
+WORKER_COUNT = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+# How long results are reused across requests and workers (0 disables caching for a kind)
+CACHE_TTLS = {
+    "translate": int(os.getenv("CACHE_TTL_TRANSLATE", "86400")),
+    "serper": int(os.getenv("CACHE_TTL_SERPER", "900")),
+    "scrape": int(os.getenv("CACHE_TTL_SCRAPE", "86400")),
+    "analysis": int(os.getenv("CACHE_TTL_ANALYSIS", "21600")),
+}
+# Results that must not be cached, e.g. failed analyses or empty scrapes
+UNCACHEABLE = {
+    "translate": lambda value: not value,
+    "scrape": lambda value: not value,
+    "analysis": lambda value: "error" in value,
+}
+# Such results are still kept this long, so callers that waited on the call get its outcome
+# instead of each repeating it in turn
+FAILED_RESULT_TTL_SECONDS = int(os.getenv("CACHE_TTL_FAILED", "10"))
+# An in-flight marker is renewed while its work runs and expires this long after its worker
+# stops renewing it (e.g. died mid-call)
+INFLIGHT_TTL_SECONDS = int(os.getenv("INFLIGHT_TTL_SECONDS", "30"))
+INFLIGHT_POLL_SECONDS = 0.2
+# A caller polling for a lease is listed as waiting until this long after its last poll
+LEASE_WAITER_TTL_SECONDS = 2.0
+CLEANUP_INTERVAL_SECONDS = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inflight (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL,
+    weight REAL NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS leases (
+    id TEXT PRIMARY KEY,
+    resource TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_resource ON leases (resource, user_id);
+CREATE TABLE IF NOT EXISTS lease_waiters (
+    id TEXT PRIMARY KEY,
+    resource TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    weight REAL NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quota_usage (
+    user_id TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS quota_usage_user ON quota_usage (user_id, resource, ts);
+CREATE TABLE IF NOT EXISTS planner_stats (
+    key TEXT PRIMARY KEY,
+    calls REAL NOT NULL,
+    new_urls REAL NOT NULL
+);
+"""
+
+
+class SharedStore:
+    def __init__(self, path: str = SHARED_STORE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lock = threading.Lock()
+        # Autocommit; multi-statement updates take an explicit write lock with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(inflight)")]
+        if "weight" not in columns:
+            self.conn.execute("ALTER TABLE inflight ADD COLUMN weight REAL NOT NULL DEFAULT 1")
+        self.last_cleanup = 0.0
+
+    def _transaction(self):
+        return _ImmediateTransaction(self.conn)
+
+    # Cached results
+
+    def cache_get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def cache_set(self, key: str, value: str, ttl: float):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl),
+            )
+            self._maybe_cleanup()
+
+    # In-flight markers
+
+    def claim(self, key: str, weight: float, ttl: float = INFLIGHT_TTL_SECONDS) -> Tuple[bool, float]:
+        """
+        Mark key as being computed by this worker at a priority weight.
+        Returns (claimed, weight of the live claim's holder).
+        """
+        now = time.time()
+        with self.lock, self._transaction():
+            self.conn.execute("DELETE FROM inflight WHERE key = ? AND expires <= ?", (key, now))
+            inserted = self.conn.execute(
+                "INSERT OR IGNORE INTO inflight (key, owner, expires, weight) VALUES (?, ?, ?, ?)",
+                (key, self.owner, now + ttl, weight),
+            ).rowcount
+            if inserted:
+                return True, weight
+            row = self.conn.execute("SELECT weight FROM inflight WHERE key = ?", (key,)).fetchone()
+        return False, row[0] if row else weight
+
+    def renew(self, key: str, ttl: float = INFLIGHT_TTL_SECONDS):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE inflight SET expires = ? WHERE key = ? AND owner = ?", (time.time() + ttl, key, self.owner)
+            )
+
+    def release(self, key: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (key, self.owner))
+
+    # Upstream concurrency leases
+
+    def lease_acquire(
+        self, resource: str, user_id: str, lease_id: str, capacity: int, user_limit: int, ttl: float,
+        weight: float = 1.0,
+    ) -> bool:
+        """
+        Take one node-wide slot on resource unless it, or the user's share of it, is full, or the
+        free slots are all wanted by higher-weight callers polling from other workers.
+        A caller that gets no slot is listed as waiting at its weight until it stops polling.
+        """
+        now = time.time()
+        with self.lock, self._transaction():
+            self.conn.execute("DELETE FROM leases WHERE resource = ? AND expires <= ?", (resource, now))
+            self.conn.execute("DELETE FROM lease_waiters WHERE resource = ? AND expires <= ?", (resource, now))
+            total, held = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(user_id = ?), 0) FROM leases WHERE resource = ?",
+                (user_id, resource),
+            ).fetchone()
+            # Waiters held back by their own user's limit can't use a slot, so they don't count
+            ahead = self.conn.execute(
+                """
+                SELECT COUNT(*) FROM lease_waiters w
+                WHERE w.resource = ? AND w.id != ? AND w.weight > ?
+                AND (SELECT COUNT(*) FROM leases l WHERE l.resource = w.resource AND l.user_id = w.user_id) < ?
+                """,
+                (resource, lease_id, weight, user_limit),
+            ).fetchone()[0]
+            if total >= capacity or held >= user_limit or capacity - total <= ahead:
+                self.conn.execute(
+                    """
+                    INSERT OR REPLACE INTO lease_waiters (id, resource, user_id, owner, weight, expires)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (lease_id, resource, user_id, self.owner, weight, now + LEASE_WAITER_TTL_SECONDS),
+                )
+                return False
+            self.conn.execute("DELETE FROM lease_waiters WHERE id = ?", (lease_id,))
+            self.conn.execute(
+                "INSERT INTO leases (id, resource, user_id, owner, expires) VALUES (?, ?, ?, ?, ?)",
+                (lease_id, resource, user_id, self.owner, now + ttl),
+            )
+        return True
+
+    def lease_release(self, lease_id: str):
+        """Give back a lease, or stop waiting for one."""
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+            self.conn.execute("DELETE FROM lease_waiters WHERE id = ?", (lease_id,))
+
+    def release_owned(self):
+        """Drop every lease, lease wait and in-flight marker this worker holds, e.g. on shutdown."""
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE owner = ?", (self.owner,))
+            self.conn.execute("DELETE FROM lease_waiters WHERE owner = ?", (self.owner,))
+            self.conn.execute("DELETE FROM inflight WHERE owner = ?", (self.owner,))
+
+    def leases_in_use(self, resource: str) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM leases WHERE resource = ? AND expires > ?", (resource, time.time())
+            ).fetchone()[0]
+
+    # Upstream quotas
+
+    def quota_used(self, user_id: str, resource: str, window: float) -> Tuple[int, Optional[float]]:
+        """Calls in the current window and the timestamp of the oldest one."""
+        with self.lock:
+            count, oldest = self.conn.execute(
+                "SELECT COUNT(*), MIN(ts) FROM quota_usage WHERE user_id = ? AND resource = ? AND ts > ?",
+                (user_id, resource, time.time() - window),
+            ).fetchone()
+        return count, oldest
+
+    def quota_consume(self, user_id: str, resource: str, limit: int, window: float) -> Tuple[bool, int]:
+        """Atomically count one call against the user's quota; returns (allowed, retry_after)."""
+        now = time.time()
+        with self.lock, self._transaction():
+            self.conn.execute(
+                "DELETE FROM quota_usage WHERE user_id = ? AND resource = ? AND ts <= ?",
+                (user_id, resource, now - window),
+            )
+            count, oldest = self.conn.execute(
+                "SELECT COUNT(*), MIN(ts) FROM quota_usage WHERE user_id = ? AND resource = ?",
+                (user_id, resource),
+            ).fetchone()
+            if count >= limit:
+                return False, int(window - (now - oldest)) + 1
+            self.conn.execute(
+                "INSERT INTO quota_usage (user_id, resource, ts) VALUES (?, ?, ?)", (user_id, resource, now)
+            )
+        return True, 0
+
+    # Query planner stats
+
+    def planner_record(self, key: str, new_urls: int, decay: float):
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT INTO planner_stats (key, calls, new_urls) VALUES (?, 1, ?)
+                ON CONFLICT (key) DO UPDATE SET calls = calls * ? + 1, new_urls = new_urls * ? + excluded.new_urls
+                """,
+                (key, new_urls, decay, decay),
+            )
+
+    def planner_stats(self, prefix: str) -> dict:
+        pattern = re.sub(r"([\\%_])", r"\\\1", prefix) + "%"
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, calls, new_urls FROM planner_stats WHERE key LIKE ? ESCAPE '\\'", (pattern,)
+            ).fetchall()
+        return {key: {"calls": calls, "new_urls": new_urls} for key, calls, new_urls in rows}
+
+    def planner_import(self, stats: dict):
+        """Seed planner stats (e.g. from the old JSON file) without overwriting newer rows."""
+        with self.lock, self._transaction():
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO planner_stats (key, calls, new_urls) VALUES (?, ?, ?)",
+                [(key, entry.get("calls", 0.0), entry.get("new_urls", 0.0)) for key, entry in stats.items()],
+            )
+
+    def _maybe_cleanup(self):
+        now = time.time()
+        if now - self.last_cleanup < CLEANUP_INTERVAL_SECONDS:
+            return
+        self.last_cleanup = now
+        self.conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+        self.conn.execute("DELETE FROM inflight WHERE expires <= ?", (now,))
+        self.conn.execute("DELETE FROM lease_waiters WHERE expires <= ?", (now,))
+
+
+class _ImmediateTransaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> SharedStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SharedStore()
+        return _store
+
+
+def cache_key(kind: str, key) -> str:
+    raw = key if isinstance(key, str) else json.dumps(key, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{kind}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+async def _keep_claim(store: SharedStore, key: str):
+    # Renew the marker while the work runs, including time spent queued for an upstream slot
+    while True:
+        await asyncio.sleep(INFLIGHT_TTL_SECONDS / 3)
+        await asyncio.to_thread(store.renew, key)
+
+
+async def get_or_compute(kind: str, key, factory, weight: float = 1.0):
+    """
+    Return a cached result for (kind, key) from any worker, or compute it once.
+    If another worker is already computing it at the same or a higher priority weight, wait for
+    its result instead of repeating the call; never wait on lower-priority work, which may be
+    queued behind other bulk calls. If the call being waited on raises, the waiters compute
+    their own results side by side rather than claiming the key one after another.
+    """
+    ttl = CACHE_TTLS.get(kind, 0)
+    if not ttl:
+        return await factory()
+
+    store = get_store()
+    digest = cache_key(kind, key)
+    cached = await asyncio.to_thread(store.cache_get, digest)
+    if cached is not None:
+        return json.loads(cached)
+
+    waited = False
+    while True:
+        claimed, holder_weight = await asyncio.to_thread(store.claim, digest, weight)
+        if claimed and waited:
+            # The holder released without leaving a result, so its call failed
+            await asyncio.to_thread(store.release, digest)
+            claimed = False
+            break
+        if claimed or holder_weight < weight:
+            break
+        waited = True
+        await asyncio.sleep(INFLIGHT_POLL_SECONDS)
+        cached = await asyncio.to_thread(store.cache_get, digest)
+        if cached is not None:
+            return json.loads(cached)
+
+    keeper = asyncio.create_task(_keep_claim(store, digest)) if claimed else None
+    try:
+        value = await factory()
+        if UNCACHEABLE.get(kind, lambda v: False)(value):
+            ttl = min(ttl, FAILED_RESULT_TTL_SECONDS)
+        if ttl > 0:
+            await asyncio.to_thread(store.cache_set, digest, json.dumps(value, ensure_ascii=False), ttl)
+        return value
+    finally:
+        if keeper:
+            keeper.cancel()
+            await asyncio.to_thread(store.release, digest)
@@ -0,0 +1,108 @@
+import os
+import re
+import sys
+import time
+import asyncio
+import subprocess
+
+# main.py imports this module first, so this is as close to the start of app import as we get
+IMPORT_STARTED = time.monotonic()
+
+# Warm up before /health reports ready (useful when scaling up from zero)
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+WARMUP_STEP_TIMEOUT = float(os.getenv("WARMUP_STEP_TIMEOUT", "10"))
+
+# Modules kept off the import path and loaded only by the code that needs them
+LAZY_MODULES = ["trafilatura", "lxml", "dateutil.parser", "google.oauth2.id_token", "openpyxl", "pyarrow"]
+
+state = {
+    "appImportSeconds": None,
+    "warm": not WARMUP_ON_STARTUP,
+    "warmupSteps": {},
+}
+
+
+def mark_app_imported():
+    state["appImportSeconds"] = round(time.monotonic() - IMPORT_STARTED, 3)
+    print(f"App imported in {state['appImportSeconds']}s")
+
+
+def _import_scraping_modules():
+    import dateutil.parser  # noqa: F401
+    import trafilatura  # noqa: F401
+    import trafilatura.settings  # noqa: F401
+    import trafilatura.meta  # noqa: F401
+
+
+def _open_caches():
+    from rollups import get_store
+    from shared_store import get_store as get_shared_store
+    get_store()
+    get_shared_store()
+
+
+async def _open_connections():
+    # A cheap request per upstream leaves a pooled, TLS-established connection behind
+    from http_clients import get_client
+    from api.ms.news import SERPER_API_URL, AZURE_OPENAI_ENDPOINT
+
+    targets = [("serper", SERPER_API_URL)]
+    if AZURE_OPENAI_ENDPOINT:
+        targets.append(("azure_openai", AZURE_OPENAI_ENDPOINT))
+    for name, url in targets:
+        try:
+            await get_client(name).head(url, timeout=WARMUP_STEP_TIMEOUT)
+        except Exception as e:
+            print(f"Warm-up connection to {name} failed: {e}")
+
+
+async def warm_up():
+    """Load lazy modules and caches and pre-open upstream connections, then mark the app warm."""
+    steps = [
+        ("imports", lambda: asyncio.to_thread(_import_scraping_modules)),
+        ("caches", lambda: asyncio.to_thread(_open_caches)),
+        ("connections", _open_connections),
+    ]
+    try:
+        for name, step in steps:
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(step(), timeout=WARMUP_STEP_TIMEOUT)
+            except Exception as e:
+                print(f"Warm-up step '{name}' failed: {e}")
+            state["warmupSteps"][name] = round(time.monotonic() - started, 3)
+    finally:
+        state["warm"] = True
+        print(f"Warm-up finished: {state['warmupSteps']}")
+
+
+def import_report() -> dict:
+    return {
+        **state,
+        "pid": os.getpid(),
+        "lazyModulesLoaded": {name: name in sys.modules for name in LAZY_MODULES},
+        "modulesLoaded": len(sys.modules),
+    }
+
+
+if __name__ == "__main__":
+    # python startup.py [N]: slowest modules by cumulative import time when loading the app
+    top = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    ).stderr
+    rows = []
+    for line in output.splitlines():
+        match = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(.*)$", line)
+        if match:
+            rows.append((int(match.group(2)), int(match.group(1)), match.group(3).strip()))
+    if not rows:
+        print(output)
+        sys.exit(1)
+    rows.sort(reverse=True)
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative, own, module in rows[:top]:
+        print(f"{cumulative / 1000:>14.1f} {own / 1000:>9.1f}  {module}")
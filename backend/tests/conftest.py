@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# Tests import backend modules the way main.py does (e.g. `from api.ms.analysis import ...`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shared_store  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A fresh shared store in a temporary directory, used by everything that calls get_store()."""
+    monkeypatch.setattr(shared_store, "_store", shared_store.SharedStore(str(tmp_path / "shared_state.db")))
+    return shared_store._store
@@ -0,0 +1,61 @@
+from api.ms.analysis import repair_json, validate_analysis
+
+
+def test_valid_json_is_not_repaired():
+    assert repair_json('{"sentiment": "negative"}') == ({"sentiment": "negative"}, False)
+
+
+def test_fences_prose_and_trailing_commas():
+    raw = 'Here you go:\n```json\n{"tags": ["fraud", "bribery",], "crimeRelated": true,}\n```'
+    assert repair_json(raw) == ({"tags": ["fraud", "bribery"], "crimeRelated": True}, True)
+
+
+def test_python_literals_in_value_position():
+    data, repaired = repair_json('{"crimeRelated": True, "publishDate": None, "flags": [False, True],}')
+    assert repaired
+    assert data == {"crimeRelated": True, "publishDate": None, "flags": [False, True]}
+
+
+def test_python_literals_inside_strings_are_kept():
+    raw = '{"summary": "None of the directors were charged; True story", "crimeRelated": False,}'
+    data, _ = repair_json(raw)
+    assert data == {"summary": "None of the directors were charged; True story", "crimeRelated": False}
+
+
+def test_truncated_string_is_dropped():
+    data, repaired = repair_json('{"sentiment": "negative", "summary": "The company was fi')
+    assert repaired
+    assert data == {"sentiment": "negative"}
+
+
+def test_truncated_literal_is_dropped():
+    data, _ = repair_json('{"sentiment": "negative", "crimeRelated": tru')
+    assert data == {"sentiment": "negative"}
+
+
+def test_truncated_number_is_dropped():
+    data, _ = repair_json('{"sentiment": "negative", "confidence": 8')
+    assert data == {"sentiment": "negative"}
+
+
+def test_truncated_array_is_closed():
+    data, _ = repair_json('{"tags": ["fraud", "brib')
+    assert data == {"tags": ["fraud"]}
+
+
+def test_unrecoverable_output():
+    assert repair_json("") == (None, False)
+    assert repair_json("I cannot help with that.") == (None, False)
+
+
+def test_validate_drops_bad_fields_and_reports_missing():
+    valid, missing = validate_analysis({"sentiment": " Negative ", "confidence": "85%", "subjectMatchScore": 250})
+    assert valid == {"sentiment": "negative", "confidence": 85.0}
+    assert "subjectMatchScore" in missing
+    assert "publishDate" not in missing
+
+
+def test_prose_with_braces_after_the_object():
+    data, repaired = repair_json('{"tags": ["a"], "confidence": 85}\nNote: {x}')
+    assert repaired
+    assert data == {"tags": ["a"], "confidence": 85}
@@ -0,0 +1,41 @@
+import asyncio
+import csv
+import io
+
+from export import EXPORT_COLUMNS, export_csv, to_row
+
+
+async def _results(*rows):
+    for row in rows:
+        yield row
+
+
+def read_csv(*rows):
+    async def collect():
+        return b"".join([chunk async for chunk in export_csv(_results(*rows))])
+
+    text = asyncio.run(collect()).decode("utf-8").lstrip("\ufeff")
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def test_formula_cells_are_escaped_in_csv():
+    [row] = read_csv({
+        "originalTitle": '=HYPERLINK("http://evil.example","click")',
+        "summary": "+1 and -2",
+        "source": "@SUM(A1:A2)",
+        "tags": ["-fraud", "bribery"],
+        "confidence": -5,
+    })
+    assert row["originalTitle"] == '\'=HYPERLINK("http://evil.example","click")'
+    assert row["summary"] == "'+1 and -2"
+    assert row["source"] == "'@SUM(A1:A2)"
+    assert row["tags"] == "'-fraud; bribery"
+    # Numbers keep their sign
+    assert row["confidence"] == "-5.0"
+
+
+def test_plain_text_and_parquet_rows_are_unchanged():
+    result = {"originalTitle": "=not a formula in parquet", "summary": "Plain summary"}
+    columns = [name for name, _ in EXPORT_COLUMNS]
+    assert to_row(result)[columns.index("originalTitle")] == "=not a formula in parquet"
+    assert to_row(result, spreadsheet=True)[columns.index("summary")] == "Plain summary"
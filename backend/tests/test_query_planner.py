@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from api.ms import query_planner
+from api.ms.query_planner import QueryPlanner
+
+
+@pytest.fixture(autouse=True)
+def no_exploration(store, monkeypatch):
+    monkeypatch.setattr(query_planner, "EXPLORE_RATE", 0.0)
+
+
+def languages(plan):
+    return [lang for _, lang, _, _ in plan]
+
+
+def test_fresh_planner_prunes_from_recorded_stats(tmp_path):
+    recorder = QueryPlanner(str(tmp_path / "missing.json"))
+    for _ in range(15):
+        recorder.record("us", "hi", "entity", 0)
+        recorder.record("us", "en", "entity", 20)
+
+    # A new planner (another worker, or after a restart) sees the same stats
+    planner = QueryPlanner(str(tmp_path / "missing.json"))
+    plan = planner.plan("us", [("Acme Corp", "entity")])
+    assert "hi" not in languages(plan)
+    assert languages(plan)[0] == "en"
+
+
+def test_stats_are_per_country(tmp_path):
+    recorder = QueryPlanner(str(tmp_path / "missing.json"))
+    for _ in range(15):
+        recorder.record("us", "hi", "entity", 0)
+
+    plan = QueryPlanner(str(tmp_path / "missing.json")).plan("in", [("Acme Corp", "entity")])
+    assert "hi" in languages(plan)
+
+
+def test_legacy_json_stats_are_imported(tmp_path):
+    legacy = tmp_path / "query_planner_stats.json"
+    legacy.write_text(json.dumps({"us|hi|entity": {"calls": 15.0, "new_urls": 0.0}}))
+
+    plan = QueryPlanner(str(legacy)).plan("us", [("Acme Corp", "entity")])
+    assert "hi" not in languages(plan)
+    assert not legacy.exists()
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+import scheduler
+from scheduler import FairQueue, QuotaExceededError
+
+
+@pytest.fixture(autouse=True)
+def _store(store):
+    return store
+
+
+def run(coro):
+    async def with_cleanup():
+        try:
+            return await coro
+        finally:
+            await scheduler.release_worker_leases()
+    return asyncio.run(with_cleanup())
+
+
+async def settle():
+    # Let granted waiters finish their lease and quota round-trips
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+
+
+def test_interactive_flow_is_served_ahead_of_bulk():
+    async def scenario():
+        queue = FairQueue("serper", capacity=1, user_limit=10, quota=0)
+        holder = await queue.acquire("holder", "interactive")
+
+        tasks = {}
+        for _ in range(4):
+            tasks[asyncio.create_task(queue.acquire("bulk-user", "bulk"))] = "bulk"
+        for _ in range(4):
+            tasks[asyncio.create_task(queue.acquire("interactive-user", "interactive"))] = "interactive"
+        await asyncio.sleep(0)
+
+        order = []
+        queue.release("holder", holder)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            assert len(done) == 1
+            task = done.pop()
+            order.append(tasks[task])
+            queue.release("bulk-user" if tasks[task] == "bulk" else "interactive-user", task.result())
+        return order
+
+    order = run(scenario())
+    assert order[:3] == ["interactive"] * 3
+    assert order[-3:] == ["bulk"] * 3
+
+
+def test_user_concurrency_cap():
+    async def scenario():
+        queue = FairQueue("llm", capacity=4, user_limit=2, quota=0)
+        greedy = [asyncio.create_task(queue.acquire("greedy", "interactive")) for _ in range(3)]
+        other = asyncio.create_task(queue.acquire("other", "interactive"))
+        await settle()
+        granted = [task for task in greedy if task.done()]
+        assert len(granted) == 2
+        assert other.done()  # a free slot goes to another user, not to the capped one
+
+        queue.release("greedy", granted[0].result())
+        await settle()
+        assert all(task.done() for task in greedy)
+        assert queue.user_in_flight["greedy"] == 2
+
+        for task in greedy:
+            if task is not granted[0]:
+                queue.release("greedy", task.result())
+        queue.release("other", other.result())
+        return queue.in_flight
+
+    assert run(scenario()) == 0
+
+
+def test_quota_is_charged_only_on_dispatch(store):
+    async def scenario():
+        queue = FairQueue("serper", capacity=1, user_limit=10, quota=2)
+        holder = await queue.acquire("user", "interactive")
+        waiter = asyncio.create_task(queue.acquire("user", "interactive"))
+        await settle()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert store.quota_used("user", "serper", scheduler.QUOTA_WINDOW_SECONDS)[0] == 1
+
+        queue.release("user", holder)
+        queue.release("user", await queue.acquire("user", "interactive"))
+        with pytest.raises(QuotaExceededError):
+            await queue.acquire("user", "interactive")
+        return queue.in_flight
+
+    # A call refused by the quota hands its slot back
+    assert run(scenario()) == 0
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_handed_on():
+    async def scenario():
+        queue = FairQueue("scrape", capacity=1, user_limit=10, quota=0)
+        holder = await queue.acquire("a", "interactive")
+        cancelled = asyncio.create_task(queue.acquire("b", "interactive"))
+        await asyncio.sleep(0)
+
+        # Release grants the slot to the waiter; cancel it before it gets to run
+        queue.release("a", holder)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert cancelled.cancelled()
+        assert queue.in_flight == 0
+
+        next_lease = await asyncio.wait_for(queue.acquire("c", "interactive"), timeout=2)
+        queue.release("c", next_lease)
+        return queue.in_flight
+
+    assert run(scenario()) == 0
+
+
+def test_stats_can_be_limited_to_one_user():
+    async def scenario():
+        queue = FairQueue("serper", capacity=2, user_limit=2, quota=0)
+        leases = [await queue.acquire(user, "interactive") for user in ("alice@example.com", "bob@example.com")]
+        mine = await queue.stats("alice@example.com")
+        everyone = await queue.stats()
+        for user, lease in zip(("alice@example.com", "bob@example.com"), leases):
+            queue.release(user, lease)
+        return mine, everyone
+
+    mine, everyone = run(scenario())
+    assert set(mine["users"]) == {"alice@example.com"}
+    assert set(everyone["users"]) == {"alice@example.com", "bob@example.com"}
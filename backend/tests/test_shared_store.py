@@ -0,0 +1,196 @@
+import asyncio
+import time
+
+import pytest
+
+import shared_store
+from scheduler import FairQueue
+from shared_store import SharedStore, get_or_compute
+
+
+def other_worker(store):
+    """A second connection to the same file, standing in for another uvicorn worker."""
+    return SharedStore(store.conn.execute("PRAGMA database_list").fetchone()[2])
+
+
+def test_claim_is_exclusive_across_workers(store):
+    other = other_worker(store)
+    assert store.claim("key", 4.0) == (True, 4.0)
+    assert other.claim("key", 1.0) == (False, 4.0)
+
+    # Only the holder can release its claim
+    other.release("key")
+    assert other.claim("key", 1.0) == (False, 4.0)
+    store.release("key")
+    assert other.claim("key", 1.0) == (True, 1.0)
+
+
+def test_expired_claim_is_taken_over_unless_renewed(store):
+    other = other_worker(store)
+    assert store.claim("key", 1.0, ttl=0.2)[0]
+    time.sleep(0.1)
+    store.renew("key", ttl=0.2)
+    time.sleep(0.15)
+    assert not other.claim("key", 1.0)[0]  # renewed, still live
+
+    time.sleep(0.1)
+    assert other.claim("key", 1.0)[0]  # holder stopped renewing
+
+
+def test_concurrent_callers_share_one_call(store):
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.3)
+        return {"summary": "ok"}
+
+    async def scenario():
+        return await asyncio.gather(*(get_or_compute("analysis", "key", factory) for _ in range(4)))
+
+    assert asyncio.run(scenario()) == [{"summary": "ok"}] * 4
+    assert len(calls) == 1
+
+
+def test_waiters_get_an_uncacheable_outcome_instead_of_repeating_it(store, monkeypatch):
+    monkeypatch.setattr(shared_store, "FAILED_RESULT_TTL_SECONDS", 1)
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.3)
+        return {"error": "model refused"}
+
+    async def scenario():
+        return await asyncio.gather(*(get_or_compute("analysis", "key", factory) for _ in range(4)))
+
+    assert asyncio.run(scenario()) == [{"error": "model refused"}] * 4
+    assert len(calls) == 1
+
+    # It is not kept like a real result
+    time.sleep(1.1)
+    assert asyncio.run(get_or_compute("analysis", "key", factory)) == {"error": "model refused"}
+    assert len(calls) == 2
+
+
+def test_waiters_run_side_by_side_after_the_holder_raises(store):
+    running = 0
+    peak = 0
+
+    async def factory():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            await asyncio.sleep(0.3)
+        finally:
+            running -= 1
+        if peak == 1:
+            raise RuntimeError("upstream down")
+        return {"summary": "ok"}
+
+    async def scenario():
+        return await asyncio.gather(
+            *(get_or_compute("analysis", "key", factory) for _ in range(4)), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert sum(isinstance(r, RuntimeError) for r in results) == 1
+    # The waiters overlapped rather than each claiming the key in turn
+    assert peak > 1
+
+
+def test_higher_priority_caller_does_not_wait_on_lower(store):
+    calls = []
+
+    async def factory(delay):
+        calls.append(delay)
+        await asyncio.sleep(delay)
+        return {"summary": "ok"}
+
+    async def scenario():
+        bulk = asyncio.create_task(get_or_compute("analysis", "key", lambda: factory(1.0), weight=1.0))
+        await asyncio.sleep(0.1)
+        started = time.monotonic()
+        await get_or_compute("analysis", "key", lambda: factory(0.1), weight=4.0)
+        elapsed = time.monotonic() - started
+        await bulk
+        return elapsed
+
+    assert asyncio.run(scenario()) < 0.5
+    assert calls == [1.0, 0.1]
+
+
+def test_cancelled_lease_wait_leaves_no_lease(store):
+    other = other_worker(store)
+
+    async def scenario():
+        queue = FairQueue("scrape", capacity=1, user_limit=10, quota=0)
+        # Another worker holds the only node-wide slot, so this worker polls for a lease
+        assert other.lease_acquire("scrape", "a", "theirs", 1, 10, 60)
+        waiter = asyncio.create_task(queue.acquire("b", "interactive"))
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        other.lease_release("theirs")
+        await asyncio.sleep(0.2)
+        return queue.in_flight, store.leases_in_use("scrape")
+
+    assert asyncio.run(scenario()) == (0, 0)
+
+
+@pytest.mark.parametrize("delay", [0.0, 0.001, 0.005])
+def test_lease_granted_as_the_caller_is_cancelled_is_released(store, delay):
+    async def scenario():
+        queue = FairQueue("scrape", capacity=1, user_limit=10, quota=0)
+        task = asyncio.create_task(queue.acquire("a", "interactive"))
+        await asyncio.sleep(delay)
+        task.cancel()
+        results = await asyncio.gather(task, return_exceptions=True)
+        if not isinstance(results[0], asyncio.CancelledError):
+            queue.release("a", results[0])
+        # Let a shielded attempt and its release finish
+        await asyncio.sleep(0.2)
+        return queue.in_flight
+
+    assert asyncio.run(scenario()) == 0
+    assert store.leases_in_use("scrape") == 0
+
+
+def test_free_slot_is_left_to_a_higher_weight_waiter_in_another_worker(store):
+    other = other_worker(store)
+    assert store.lease_acquire("llm", "holder", "held", 1, 10, 60)
+    # An interactive call in the other worker finds the resource full and waits
+    assert not other.lease_acquire("llm", "alice", "interactive", 1, 10, 60, weight=4.0)
+
+    store.lease_release("held")
+    assert not store.lease_acquire("llm", "bob", "bulk", 1, 10, 60, weight=1.0)
+    assert other.lease_acquire("llm", "alice", "interactive", 1, 10, 60, weight=4.0)
+
+    # Once it stops waiting, lower-weight callers are no longer held back
+    other.lease_release("interactive")
+    assert store.lease_acquire("llm", "bob", "bulk", 1, 10, 60, weight=1.0)
+
+
+def test_waiter_at_its_user_limit_does_not_hold_back_others(store):
+    other = other_worker(store)
+    assert other.lease_acquire("llm", "alice", "first", 2, 1, 60, weight=4.0)
+    assert not other.lease_acquire("llm", "alice", "second", 2, 1, 60, weight=4.0)
+    assert store.lease_acquire("llm", "bob", "bulk", 2, 1, 60, weight=1.0)
+
+
+def test_cancelled_poller_stops_holding_back_others(store):
+    other = other_worker(store)
+
+    async def scenario():
+        queue = FairQueue("llm", capacity=1, user_limit=10, quota=0)
+        assert other.lease_acquire("llm", "holder", "held", 1, 10, 60)
+        waiter = asyncio.create_task(queue.acquire("alice", "interactive"))
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await asyncio.sleep(0.05)
+        other.lease_release("held")
+        return other.lease_acquire("llm", "bob", "bulk", 1, 10, 60, weight=1.0)
+
+    assert asyncio.run(scenario())